@@ -1,17 +1,140 @@
-from fastapi import FastAPI, HTTPException
+from collections import Counter, deque
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
+import asyncio
 import asyncpg
+import base64
+import binascii
 import os
+import struct
+import time
+from datetime import datetime
 from dotenv import load_dotenv
 import numpy as np
+from feed_cache import FeedCache
+from liked_cache import LikedSetCache
+from shared_vectors import SharedUserVectors
+from snapshot import read_snapshot
+from post_index import (
+    CompressedPostIndex,
+    IVFPostIndex,
+    PostIdSampler,
+    PostIndex,
+    load_post_index,
+    normalize_rows,
+    top_k,
+)
+from user_registry import UserRegistry
+from vector_codec import register_vector_codec
+from vector_writer import UserVectorWriter
 
 load_dotenv()
 
 app = FastAPI(title="Preference Feed Engine")
 
-# In-memory storage for user vectors
-user_vectors = {}
+# In-memory user registry: username -> id, vector and metadata. Profiles
+# are loaded on first use and the least recently used beyond
+# USER_CACHE_MAX_USERS are evicted (0 loads every user at startup instead);
+# the USER_WARMUP_USERS most recently active users are preloaded. Keep the
+# limit well above the number of users with requests in flight
+USER_CACHE_MAX_USERS = int(os.getenv("USER_CACHE_MAX_USERS", 100000))
+USER_WARMUP_USERS = int(os.getenv("USER_WARMUP_USERS", 10000))
+users = UserRegistry(max_users=USER_CACHE_MAX_USERS or None)
+# In-flight profile loads by username, shared by concurrent requests
+user_loads = {}
+# Requests in flight per username; these users are never evicted, so a
+# handler can hold on to their registry rows across awaits
+active_users = Counter()
+
+# Feed retrieval backend: "exact" scores the in-memory matrix by brute
+# force, "ivf" probes an in-memory inverted file, "pgvector" queries the
+# HNSW index built by create_vector_index.py
+FEED_RETRIEVAL = os.getenv("FEED_RETRIEVAL", "exact")
+if FEED_RETRIEVAL not in ("exact", "ivf", "pgvector"):
+    raise ValueError(f"Unknown FEED_RETRIEVAL backend: {FEED_RETRIEVAL}")
+
+IVF_NLIST = int(os.getenv("IVF_NLIST", 512))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", 100))
+PGVECTOR_CANDIDATES = int(os.getenv("PGVECTOR_CANDIDATES", 100))
+# pgvector rejects hnsw.ef_search above 1000, which bounds the Hamming
+# candidates per query; re-ranking PGVECTOR_RERANK_FACTOR candidates per
+# result caps a pgvector ranking at PGVECTOR_MAX_DEPTH posts
+HNSW_MAX_EF_SEARCH = 1000
+PGVECTOR_RERANK_FACTOR = int(os.getenv("PGVECTOR_RERANK_FACTOR", 3))
+PGVECTOR_MAX_DEPTH = HNSW_MAX_EF_SEARCH // PGVECTOR_RERANK_FACTOR
+
+# Compressed post store for exact retrieval: "truncate" (Matryoshka) or
+# "pca" reduction and/or int8 quantization, re-ranked against full vectors
+POST_REDUCTION = os.getenv("POST_REDUCTION", "none")
+POST_REDUCED_DIM = int(os.getenv("POST_REDUCED_DIM", 1024))
+POST_QUANTIZE = os.getenv("POST_QUANTIZE", "0") == "1"
+POST_RERANK_CANDIDATES = int(os.getenv("POST_RERANK_CANDIDATES", 100))
+
+# In-memory matrix of post embeddings, scored on every feed request
+if FEED_RETRIEVAL == "ivf":
+    post_index = IVFPostIndex(nlist=IVF_NLIST, nprobe=IVF_NPROBE)
+elif POST_REDUCTION != "none" or POST_QUANTIZE:
+    post_index = CompressedPostIndex(
+        reduce=POST_REDUCTION, reduced_dim=POST_REDUCED_DIM, quantize=POST_QUANTIZE
+    )
+else:
+    post_index = PostIndex()
+POST_LOAD_BATCH_SIZE = int(os.getenv("POST_LOAD_BATCH_SIZE", 10000))
+
+# Embedded post ids for exploration feeds in pgvector mode, where no
+# in-memory post index is kept
+post_sampler = PostIdSampler()
+FEED_SIZE = 15
+
+# Per-user liked post ids, kept write-through with /like and /unlike
+liked_cache = LikedSetCache(max_users=int(os.getenv("LIKED_CACHE_MAX_USERS", 100000)))
+
+# Per-user ranked feeds, FEED_CACHE_DEPTH posts deep, reused until the user
+# vector changes; pages are slices of the ranking
+FEED_CACHE_DEPTH = int(os.getenv("FEED_CACHE_DEPTH", 300))
+FEED_MAX_PAGE_SIZE = 100
+feed_cache = FeedCache(max_users=int(os.getenv("FEED_CACHE_MAX_USERS", 10000)))
+# Bumped whenever posts are added to the index. post_index_log keeps the
+# ids each bump added, up to POST_LOG_MAX_POSTS in all, so a ranking cached
+# a few generations ago only has to score those posts to catch up
+post_index_version = 0
+POST_LOG_MAX_POSTS = int(os.getenv("POST_LOG_MAX_POSTS", 10000))
+post_index_log = deque()
+post_index_log_size = 0
+
+# POST /feeds/batch ranks up to BATCH_FEED_MAX_USERS users per request with
+# blocked matrix products; approximate indexes re-rank BATCH_RERANK_USERS
+# users' candidates per database round trip
+BATCH_FEED_MAX_USERS = int(os.getenv("BATCH_FEED_MAX_USERS", 1000))
+BATCH_RERANK_USERS = 32
+
+# User vectors are persisted write-behind: /like and /unlike append to a
+# local log and mark the user dirty, and dirty vectors are bulk-written to
+# user_prefs_api at most USER_VECTOR_FLUSH_INTERVAL seconds later
+USER_VECTOR_FLUSH_INTERVAL = float(os.getenv("USER_VECTOR_FLUSH_INTERVAL", 1.0))
+user_vector_writer = UserVectorWriter(
+    users,
+    os.getenv("USER_VECTOR_LOG_DIR", ".user_vector_log"),
+    fsync=os.getenv("USER_VECTOR_LOG_FSYNC", "0") == "1",
+)
+user_vector_flusher = None
+
+# With several uvicorn workers, each keeps its own registry; setting
+# SHARED_USER_VECTORS to a file on tmpfs (e.g. /dev/shm/pfe_user_vectors)
+# makes /like and /unlike publish new vectors there under a per-user lock
+# and NOTIFY USER_VECTORS_CHANNEL so the other workers adopt them
+USER_VECTORS_CHANNEL = "user_vectors"
+SHARED_USER_VECTORS_PATH = os.getenv("SHARED_USER_VECTORS")
+shared_user_vectors = None
+
+# Memory-mapped vector snapshots written by snapshot_vectors.py; when present
+# startup maps them and reads only rows that changed since from Postgres
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+USER_SNAPSHOT_PATH = os.path.join(SNAPSHOT_DIR, "users.snap")
+POST_SNAPSHOT_PATH = os.path.join(SNAPSHOT_DIR, "posts.snap")
 
 # Database connection config
 db_config = {
@@ -22,50 +145,851 @@ db_config = {
     "port": int(os.getenv("PSQL_DB_PORT", 5432)),
 }
 
+# Connection pool config
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 20))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5.0))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256))
+
+# Shared pool, created on startup and closed on shutdown
+db_pool = None
+
+# Dedicated connection that hears ingest_worker.py announce new post vectors
+# (and other workers announce user vectors, when shared)
+POST_VECTORS_CHANNEL = "post_vectors"
+post_listener = None
+# Reconnect delays (seconds) after the listener connection drops, doubling
+LISTENER_RECONNECT_DELAY = 1.0
+LISTENER_RECONNECT_MAX_DELAY = 60.0
+post_index_ready = asyncio.Event()
+# Held while a search scans the index off the event loop, so new posts
+# are not upserted (possibly reallocating the matrix) underneath it
+post_index_lock = asyncio.Lock()
+background_tasks = set()
+pool_stats = {
+    "acquired": 0,
+    "timeouts": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
 
 class LikeRequest(BaseModel):
     username: str
     post_id: int
 
 
-def cosine_similarity(vec1, vec2):
-    """Calculate cosine similarity between two vectors"""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
+class LikedStatusRequest(BaseModel):
+    username: str
+    post_ids: list[int]
+
+
+class BatchFeedRequest(BaseModel):
+    usernames: list[str]
+    k: int = FEED_SIZE
+    exclude_liked: bool = False
+
 
-    # Handle zero vectors
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
+async def create_db_pool():
+    return await asyncpg.create_pool(
+        **db_config,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        init=register_vector_codec,
+    )
+
+
+@asynccontextmanager
+async def acquire_connection():
+    """Borrow a pooled connection, recording how long the caller waited"""
+    start = time.perf_counter()
+    try:
+        conn = await db_pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        pool_stats["timeouts"] += 1
+        raise HTTPException(status_code=503, detail="Database pool exhausted")
+
+    waited = time.perf_counter() - start
+    pool_stats["acquired"] += 1
+    pool_stats["wait_seconds_total"] += waited
+    pool_stats["wait_seconds_max"] = max(pool_stats["wait_seconds_max"], waited)
+    try:
+        yield conn
+    finally:
+        await db_pool.release(conn)
+
+
+async def get_liked_post_ids(username):
+    """Return the user's sorted liked post ids, loading them on a cache miss"""
+    liked = liked_cache.get(username)
+    if liked is None:
+        # A like or unlike landing during the query makes the result stale
+        stamp = liked_cache.stamp()
+        async with acquire_connection() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT post_id FROM user_likes WHERE user_id = $1
+            """,
+                users.user_id(username),
+            )
+        liked = np.unique(np.array([row["post_id"] for row in rows], dtype=np.int64))
+        liked_cache.put(username, liked, stamp)
+    return liked
+
+
+async def get_liked_post_ids_many(usernames):
+    """get_liked_post_ids for many users, loading cache misses in one query"""
+    liked = {username: liked_cache.get(username) for username in usernames}
+    missing = [username for username, post_ids in liked.items() if post_ids is None]
+    if missing:
+        user_ids = [users.user_id(username) for username in missing]
+        stamp = liked_cache.stamp()
+        async with acquire_connection() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT user_id, array_agg(post_id) AS post_ids
+                FROM user_likes
+                WHERE user_id = ANY($1)
+                GROUP BY user_id
+            """,
+                user_ids,
+            )
+        by_user = {row["user_id"]: row["post_ids"] for row in rows}
+        for username, user_id in zip(missing, user_ids):
+            post_ids = np.unique(np.asarray(by_user.get(user_id, []), dtype=np.int64))
+            liked_cache.put(username, post_ids, stamp)
+            liked[username] = post_ids
+    return [liked[username] for username in usernames]
+
+
+async def fetch_liked_post_ids(username, post_ids):
+    """Return the subset of post_ids the user has liked"""
+    if not post_ids:
+        return set()
+    liked = await get_liked_post_ids(username)
+    mask = np.isin(np.asarray(post_ids, dtype=np.int64), liked)
+    return {post_id for post_id, hit in zip(post_ids, mask.tolist()) if hit}
+
+
+def recent_users_clause(limit, param):
+    """ORDER BY/LIMIT picking the ``limit`` most recently active users, or all"""
+    if limit is None:
+        return ""
+    # By latest like, as load_liked_sets ranks them; users who never liked
+    # anything come last
+    return f"""
+        ORDER BY (
+            SELECT max(l.liked_at) FROM user_likes l WHERE l.user_id = user_prefs_api.id
+        ) DESC NULLS LAST
+        LIMIT ${param}
+    """
 
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
 
-    return float(np.dot(vec1, vec2) / (norm1 * norm2))
+async def load_users(limit=None):
+    """Load user ids, vectors and metadata from database into memory.
 
+    With ``limit``, only the most recently active users are loaded.
+    """
+    if os.path.exists(USER_SNAPSHOT_PATH):
+        await load_users_from_snapshot(limit)
+        return
+
+    async with acquire_connection() as conn:
+        args = () if limit is None else (limit,)
+        rows = await conn.fetch(
+            "SELECT id, username, user_vector, created_at FROM user_prefs_api"
+            + recent_users_clause(limit, 1),
+            *args,
+        )
+        # Least recently active first, so the most active end up most recently used
+        for user in reversed(rows):
+            # The vector codec decodes straight into a float32 array
+            users.add(
+                user["username"], user["id"], user["user_vector"], user["created_at"]
+            )
+        print(f"Loaded {len(users)} users into memory")
 
-async def get_db_connection():
-    return await asyncpg.connect(**db_config)
 
+async def load_users_from_snapshot(limit=None):
+    """Load user vectors from the snapshot, re-reading only newer ones"""
+    header, snapshot_ids, snapshot_vectors = read_snapshot(USER_SNAPSHOT_PATH)
+    watermark = datetime.fromisoformat(header["watermark"])
+    async with acquire_connection() as conn:
+        args = () if limit is None else (limit,)
+        rows = await conn.fetch(
+            """
+            SELECT id, username, created_at, vector_updated_at > $1 AS changed
+            FROM user_prefs_api
+        """
+            + recent_users_clause(limit, 2),
+            watermark,
+            *args,
+        )
+        # Least recently active first, as in load_users
+        rows = rows[::-1]
+        ids = np.array([user["id"] for user in rows], dtype=np.int64)
+        pos = np.searchsorted(snapshot_ids, ids).clip(max=max(len(snapshot_ids) - 1, 0))
+        in_snapshot = np.zeros(len(ids), dtype=bool)
+        if len(snapshot_ids):
+            in_snapshot = snapshot_ids[pos] == ids
+        changed = np.array([user["changed"] for user in rows], dtype=bool)
+        stale = ids[~in_snapshot | changed]
+        fresh = {}
+        if len(stale):
+            fresh = {
+                row["id"]: row["user_vector"]
+                for row in await conn.fetch(
+                    "SELECT id, user_vector FROM user_prefs_api WHERE id = ANY($1)",
+                    stale.tolist(),
+                )
+            }
 
-async def load_user_vectors():
-    """Load user vectors from database into memory"""
-    conn = await get_db_connection()
+    for user, row in zip(rows, pos.tolist()):
+        vector = fresh.get(user["id"])
+        if vector is None:
+            vector = snapshot_vectors[row]
+        users.add(user["username"], user["id"], vector, user["created_at"])
+    print(
+        f"Loaded {len(users)} users into memory from {USER_SNAPSHOT_PATH} "
+        f"({len(fresh)} vectors read from the database)"
+    )
+
+
+async def load_liked_sets():
+    """Warm the liked-set cache with the most recently active users' likes"""
+    async with acquire_connection() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT u.username,
+                   array_remove(array_agg(l.post_id), NULL) AS post_ids
+            FROM user_prefs_api u
+            LEFT JOIN user_likes l ON l.user_id = u.id
+            GROUP BY u.username
+            ORDER BY max(l.liked_at) DESC NULLS LAST
+            LIMIT $1
+        """,
+            liked_cache.max_users,
+        )
+    # Least recently active first, so the most active end up most recent
+    for row in reversed(rows):
+        liked_cache.put(row["username"], row["post_ids"])
+    print(f"Loaded liked posts for {len(liked_cache)} users into memory")
+
+
+async def load_post_vectors():
+    """Load all post embeddings into the in-memory post index"""
+    async with acquire_connection() as conn:
+        await load_post_index(post_index, conn, POST_SNAPSHOT_PATH, POST_LOAD_BATCH_SIZE)
+
+
+async def load_post_ids():
+    """Load embedded post ids into the sampling pool (pgvector mode)"""
+    async with acquire_connection() as conn:
+        # Served by the partial index on embedded ids, without touching vectors
+        ids = await conn.fetchval(
+            "SELECT array_agg(id ORDER BY id) FROM social_search_prefs WHERE qwen_vector IS NOT NULL"
+        )
+    post_sampler.load(ids or [])
+    print(f"Loaded {len(post_sampler)} post ids for sampling")
+
+
+async def rerank_exact(query, post_ids, k):
+    """Re-score candidate posts against their full-precision vectors"""
+    async with acquire_connection() as conn:
+        rows = await conn.fetch(
+            "SELECT id, qwen_vector FROM social_search_prefs WHERE id = ANY($1)",
+            np.asarray(post_ids).tolist(),
+        )
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    ids = np.array([row["id"] for row in rows], dtype=np.int64)
+    vectors = normalize_rows(np.stack([row["qwen_vector"] for row in rows]))
+    scores = vectors @ (query / np.linalg.norm(query))
+    top = top_k(scores, k)
+    return ids[top], scores[top]
+
+
+async def search_pgvector(query, k, exclude=None):
+    """Top-k posts from the pgvector HNSW index, re-ranked by exact cosine.
+
+    pgvector cannot index 4096-dim vectors directly, so the index covers
+    their binary quantization; the closest PGVECTOR_RERANK_FACTOR * k (at
+    least PGVECTOR_CANDIDATES) by Hamming distance are then re-ranked
+    against the full vectors. Rankings stop at PGVECTOR_MAX_DEPTH posts.
+    """
+    if not np.any(query):
+        # A zero vector scores every post equally; explore instead
+        return post_sampler.sample(k, exclude)
+
+    exclude = [] if exclude is None else np.asarray(exclude).tolist()
+    k = min(k, PGVECTOR_MAX_DEPTH)
+    candidates = min(max(PGVECTOR_CANDIDATES, PGVECTOR_RERANK_FACTOR * k), HNSW_MAX_EF_SEARCH)
+    async with acquire_connection() as conn:
+        async with conn.transaction():
+            # HNSW returns at most ef_search rows, so deep feeds need a wider beam
+            ef_search = min(max(PGVECTOR_EF_SEARCH, candidates), HNSW_MAX_EF_SEARCH)
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {ef_search:d}")
+            rows = await conn.fetch(
+                """
+                SELECT id, 1 - (qwen_vector <=> $1) AS score
+                FROM (
+                    SELECT id, qwen_vector
+                    FROM social_search_prefs
+                    WHERE qwen_vector IS NOT NULL AND NOT (id = ANY($4))
+                    ORDER BY binary_quantize(qwen_vector)::bit(4096)
+                        <~> binary_quantize($1::vector)::bit(4096)
+                    LIMIT $3
+                ) candidates
+                ORDER BY qwen_vector <=> $1
+                LIMIT $2
+            """,
+                query,
+                k,
+                candidates,
+                exclude,
+            )
+    ids = np.array([row["id"] for row in rows], dtype=np.int64)
+    scores = np.array([row["score"] for row in rows], dtype=np.float32)
+    return ids, scores
+
+
+async def search_posts(query, k, exclude=None):
+    """Return ids and cosine scores of the top-k posts for a user vector"""
+    if FEED_RETRIEVAL == "pgvector":
+        return await search_pgvector(query, k, exclude)
+    if post_index.approximate and np.any(query):
+        candidate_ids, _ = await search_index(query, max(k, POST_RERANK_CANDIDATES), exclude)
+        return await rerank_exact(query, candidate_ids, k)
+    return await search_index(query, k, exclude)
+
+
+async def search_index(query, k, exclude=None):
+    """post_index.search in a thread: a full sweep would stall every request"""
+    async with post_index_lock:
+        return await asyncio.to_thread(post_index.search, query, k, exclude)
+
+
+async def rerank_exact_many(queries, candidates, k):
+    """rerank_exact for many queries, fetching each group's candidates once"""
+    results = []
+    for start in range(0, len(queries), BATCH_RERANK_USERS):
+        group = candidates[start : start + BATCH_RERANK_USERS]
+        post_ids = np.unique(np.concatenate([ids for ids, _ in group]))
+        async with acquire_connection() as conn:
+            rows = await conn.fetch(
+                "SELECT id, qwen_vector FROM social_search_prefs WHERE id = ANY($1)",
+                post_ids.tolist(),
+            )
+        rows = sorted(rows, key=lambda row: row["id"])
+        ids = np.array([row["id"] for row in rows], dtype=np.int64)
+        vectors = normalize_rows(np.stack([row["qwen_vector"] for row in rows])) if rows else None
+
+        for query, (candidate_ids, candidate_scores) in zip(queries[start:], group):
+            if not np.any(query) or vectors is None:
+                # Exploration samples carry no scores to refine
+                results.append((candidate_ids[:k], candidate_scores[:k]))
+                continue
+            pos = np.searchsorted(ids, candidate_ids).clip(max=len(ids) - 1)
+            pos = pos[ids[pos] == candidate_ids]
+            scores = vectors[pos] @ (query / np.linalg.norm(query))
+            top = top_k(scores, k)
+            results.append((ids[pos][top], scores[top]))
+    return results
+
+
+async def batch_search_posts(queries, k, excludes=None):
+    """Return [(ids, scores)] of the top-k posts for each row of ``queries``"""
+    if excludes is None:
+        excludes = [None] * len(queries)
+    if FEED_RETRIEVAL == "pgvector":
+        # No resident matrix to multiply against; one HNSW query per user
+        return [
+            await search_pgvector(query, k, exclude)
+            for query, exclude in zip(queries, excludes)
+        ]
+
+    depth = max(k, POST_RERANK_CANDIDATES) if post_index.approximate else k
+    async with post_index_lock:
+        # numpy releases the GIL in the matrix products, so requests keep
+        # being served while the batch is scored
+        results = await asyncio.to_thread(post_index.search_many, queries, depth, excludes)
+    if post_index.approximate:
+        results = await rerank_exact_many(queries, results, k)
+    return results
+
+
+async def score_posts(query, post_ids):
+    """Exact cosine scores of the embedded posts among ``post_ids``"""
+    if FEED_RETRIEVAL == "pgvector" or post_index.approximate:
+        return await rerank_exact(query, post_ids, len(post_ids))
+    rows = post_index.rows_for(post_ids)
+    return post_index.ids[rows], post_index.matrix[rows] @ (query / np.linalg.norm(query))
+
+
+async def catch_up_feed(username, vector, version, exclude_liked):
+    """Merge the posts indexed since a cached ranking into it.
+
+    Returns (depth, ids, scores), or None when the ranking must be redone.
+    """
+    entry = feed_cache.peek(username, exclude_liked)
+    if entry is None:
+        return None
+    (user_version, indexed_version), depth, ids, scores = entry
+    if user_version != version[0]:
+        return None
+    new_ids = posts_indexed_since(indexed_version)
+    if new_ids is None:
+        return None
+    if len(new_ids) and np.isin(ids, new_ids).any() and len(ids) >= depth:
+        # A re-embedded post may now rank below posts the ranking cut off
+        return None
+    if exclude_liked and len(new_ids):
+        new_ids = np.setdiff1d(new_ids, await get_liked_post_ids(username))
+    if len(new_ids):
+        new_ids, new_scores = await score_posts(vector, new_ids)
+        keep = ~np.isin(ids, new_ids)
+        ids = np.concatenate([ids[keep], new_ids])
+        scores = np.concatenate([scores[keep], np.asarray(new_scores, dtype=np.float32)])
+        order = np.lexsort((ids, -scores))[:depth]
+        ids, scores = ids[order], scores[order]
+    return depth, ids, scores
+
+
+async def ranked_feed(username, depth, exclude_liked=False):
+    """Return the user's ranked post ids and scores, at least ``depth`` deep.
+
+    Rankings are cached per user until their vector changes, so refreshes
+    and further pages skip retrieval entirely; posts indexed since are
+    scored and merged in.
+    """
+    # Copied with its version, so the ranking matches the version it is cached under
+    vector = users.get_vector(username).copy()
+    version = (users.version(username), post_index_version)
+    cached = feed_cache.get(username, exclude_liked, version, depth)
+    if cached is not None:
+        return cached
+    if np.any(vector):
+        caught_up = await catch_up_feed(username, vector, version, exclude_liked)
+        if caught_up is not None:
+            ranked_depth, ids, scores = caught_up
+            feed_cache.put(username, exclude_liked, version, ranked_depth, ids, scores)
+            if len(ids) >= depth or len(ids) < ranked_depth:
+                return ids, scores
+
+    exclude = await get_liked_post_ids(username) if exclude_liked else None
+    depth = max(depth, FEED_CACHE_DEPTH)
+    ids, scores = await search_posts(vector, depth, exclude=exclude)
+    scores = np.asarray(scores, dtype=np.float32)
+    if not np.any(vector):
+        # A zero vector gets a random exploration sample: keep its random
+        # order, and don't cache it so it does not repeat
+        return ids, scores
+    # Order by (score desc, id asc) so feed cursors have a total order
+    order = np.lexsort((ids, -scores))
+    ids, scores = ids[order], scores[order]
+    feed_cache.put(username, exclude_liked, version, depth, ids, scores)
+    return ids, scores
+
+
+# Feed cursors pack the last served (score, post id) as float32 + int64
+_FEED_CURSOR = struct.Struct(">fq")
+
+
+def encode_feed_cursor(score, post_id):
+    return base64.urlsafe_b64encode(_FEED_CURSOR.pack(score, post_id)).rstrip(b"=").decode()
+
+
+def decode_feed_cursor(cursor):
+    """Return the (score, post id) boundary in a cursor; 400 if malformed"""
     try:
-        users = await conn.fetch("SELECT username, user_vector FROM user_prefs_api")
-        for user in users:
-            # Convert PostgreSQL vector to Python list
-            vector_str = user["user_vector"]
-            # Parse vector string [1.0,2.0,3.0,...] to list
-            vector_list = eval(vector_str)  # In production, use proper parsing
-            user_vectors[user["username"]] = np.array(vector_list)
-        print(f"Loaded {len(user_vectors)} user vectors into memory")
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return _FEED_CURSOR.unpack(raw)
+    except (binascii.Error, struct.error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def cursor_position(ids, scores, boundary):
+    """Index of the first ranked post after a cursor boundary"""
+    score, post_id = boundary
+    after = (scores < score) | ((scores == score) & (ids > post_id))
+    return int(np.argmax(after)) if after.any() else len(ids)
+
+
+def sample_posts(k, exclude=None):
+    """Random embedded post ids with zero scores, for cold-start feeds"""
+    if FEED_RETRIEVAL == "pgvector":
+        return post_sampler.sample(k, exclude)
+    return post_index.sample(k, exclude)
+
+
+def record_indexed_posts(post_ids):
+    """Start a new index generation made of ``post_ids``"""
+    global post_index_version, post_index_log_size
+    post_index_version += 1
+    post_index_log.append((post_index_version, np.asarray(post_ids, dtype=np.int64)))
+    post_index_log_size += len(post_ids)
+    while post_index_log_size > POST_LOG_MAX_POSTS:
+        _, dropped = post_index_log.popleft()
+        post_index_log_size -= len(dropped)
+
+
+def posts_indexed_since(version):
+    """Ids of posts indexed after generation ``version``, or None if no longer logged"""
+    since = [ids for logged, ids in post_index_log if logged > version]
+    if len(since) < post_index_version - version:
+        return None
+    return np.concatenate(since) if since else np.empty(0, dtype=np.int64)
+
+
+async def refresh_post_vectors(post_ids):
+    """Pull newly embedded posts into the post index"""
+    # Upserts before the initial load finishes would be overwritten by it
+    await post_index_ready.wait()
+    async with acquire_connection() as conn:
+        if FEED_RETRIEVAL == "pgvector":
+            # Vectors stay in Postgres; only the sampling pool needs the ids
+            ids = await conn.fetchval(
+                """
+                SELECT array_agg(id)
+                FROM social_search_prefs
+                WHERE qwen_vector IS NOT NULL AND id = ANY($1)
+            """,
+                post_ids,
+            )
+            if ids:
+                post_sampler.add(ids)
+                record_indexed_posts(ids)
+            return
+        rows = await conn.fetch(
+            """
+            SELECT id, qwen_vector
+            FROM social_search_prefs
+            WHERE qwen_vector IS NOT NULL AND id = ANY($1)
+        """,
+            post_ids,
+        )
+    if not rows:
+        return
+
+    vectors = np.stack([row["qwen_vector"] for row in rows])
+    async with post_index_lock:
+        if len(post_index) == 0:
+            post_index.fit(vectors)
+        ids = [row["id"] for row in rows]
+        post_index.upsert(ids, post_index.encode(vectors))
+        record_indexed_posts(ids)
+    print(f"Indexed {len(rows)} new posts")
+
+
+async def load_user(username):
+    """Load one user's profile into the registry; False if there is no such user"""
+    async with acquire_connection() as conn:
+        user = await conn.fetchrow(
+            "SELECT id, user_vector, created_at FROM user_prefs_api WHERE username = $1",
+            username,
+        )
+    if user is None:
+        return False
+    register_user(username, user)
+    evict_users()
+    return True
+
+
+async def load_users_by_name(usernames):
+    """Load several users' profiles in one query; return the usernames found"""
+    async with acquire_connection() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT id, username, user_vector, created_at
+            FROM user_prefs_api
+            WHERE username = ANY($1)
+        """,
+            usernames,
+        )
+    for user in rows:
+        register_user(user["username"], user)
+    evict_users()
+    return {user["username"] for user in rows}
+
+
+def register_user(username, user):
+    """Add a user_prefs_api row to the registry"""
+    users.add(username, user["id"], user["user_vector"], user["created_at"])
+    if shared_user_vectors is not None:
+        # Another worker may hold a vector newer than the table's
+        shared_user_vectors.forget(user["id"])
+        sync_user_vector(username)
+
+
+async def ensure_user(username):
+    """Make sure the user's profile is in memory; False if there is no such user.
+
+    Concurrent requests for a user being loaded wait on the same query.
+    """
+    if username in users:
+        users.touch(username)
+        return True
+    load = user_loads.get(username)
+    if load is None:
+        load = asyncio.ensure_future(load_user(username))
+        user_loads[username] = load
+        load.add_done_callback(lambda _: user_loads.pop(username, None))
+    # A cancelled request must not cancel the load other requests wait on
+    return await asyncio.shield(load)
+
+
+async def ensure_users(usernames):
+    """ensure_user for many users, loading the missing ones in one query.
+
+    Returns the usernames that exist, in order.
+    """
+    missing = [
+        username for username in usernames if username not in users and username not in user_loads
+    ]
+    loads = {}
+    if missing:
+        # Requests for these users meanwhile wait on the bulk load
+        loop = asyncio.get_running_loop()
+        loads = {username: loop.create_future() for username in missing}
+        user_loads.update(loads)
+        try:
+            loaded = await load_users_by_name(missing)
+        except BaseException as e:
+            for load in loads.values():
+                load.set_exception(e)
+            raise
+        else:
+            for username, load in loads.items():
+                load.set_result(username in loaded)
+        finally:
+            for username in loads:
+                user_loads.pop(username, None)
+
+    found = []
+    for username in usernames:
+        load = loads.get(username)
+        ok = load.result() if load is not None else await ensure_user(username)
+        if ok:
+            found.append(username)
+    return found
+
+
+@asynccontextmanager
+async def resident_users(usernames):
+    """resident_user for many users; yields the usernames that exist"""
+    active_users.update(usernames)
+    try:
+        yield await ensure_users(usernames)
+    finally:
+        active_users.subtract(usernames)
+        for username in usernames:
+            if active_users[username] <= 0:
+                active_users.pop(username, None)
+
+
+@asynccontextmanager
+async def resident_user(username):
+    """Load the user (404 if unknown) and keep them in memory for the block"""
+    active_users[username] += 1
+    try:
+        if not await ensure_user(username):
+            raise HTTPException(status_code=404, detail="User not found")
+        yield
     finally:
-        await conn.close()
+        active_users[username] -= 1
+        if not active_users[username]:
+            del active_users[username]
+
+
+def evict_users():
+    """Drop least recently used profiles beyond USER_CACHE_MAX_USERS"""
+    # Vectors not yet flushed to Postgres, and users of requests in
+    # flight, must stay in memory
+    pinned = user_vector_writer.unflushed() | active_users.keys()
+    for username in users.evict(pinned=pinned):
+        feed_cache.invalidate(username)
+        liked_cache.discard(username)
+
+
+def user_vector_lock(username):
+    """Serialize a user's vector update with the other workers, if shared"""
+    if shared_user_vectors is None:
+        return nullcontext()
+    return shared_user_vectors.lock(users.user_id(username))
+
+
+def sync_user_vector(username, locked=False):
+    """Adopt a newer vector another worker published for this user"""
+    if shared_user_vectors is None:
+        return
+    vector = shared_user_vectors.newer(users.user_id(username), locked=locked)
+    if vector is not None:
+        users.set_vector(username, vector)
+        feed_cache.invalidate(username)
+
+
+def publish_user_vector(username):
+    """Share the user's new vector; call while holding user_vector_lock"""
+    if shared_user_vectors is not None:
+        shared_user_vectors.publish(users.user_id(username), users.get_vector(username))
+
+
+async def notify_user_vector(conn, username):
+    """Tell the other workers this user's vector and likes changed"""
+    if shared_user_vectors is not None:
+        await conn.execute(
+            "SELECT pg_notify($1, $2)",
+            USER_VECTORS_CHANNEL,
+            f"{os.getpid()}:{users.user_id(username)}",
+        )
+
+
+def on_user_vectors(conn, pid, channel, payload):
+    sender, user_id = map(int, payload.split(":"))
+    if sender == os.getpid():
+        # Our own update; the liked-set cache was written through
+        return
+    username = users.username(user_id)
+    if username is not None:
+        sync_user_vector(username)
+        # Reloaded from user_likes on next use
+        liked_cache.discard(username)
+
+
+def on_post_vectors(conn, pid, channel, payload):
+    post_ids = [int(post_id) for post_id in payload.split(",")]
+    task = asyncio.create_task(refresh_post_vectors(post_ids))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def flush_user_vectors_periodically():
+    """Bulk-write dirty user vectors every USER_VECTOR_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(USER_VECTOR_FLUSH_INTERVAL)
+        if not user_vector_writer.dirty:
+            continue
+        # Don't overwrite a newer vector another worker published
+        for username in list(user_vector_writer.dirty):
+            sync_user_vector(username)
+        try:
+            async with acquire_connection() as conn:
+                await user_vector_writer.flush(conn)
+        except Exception as e:
+            # Users stay dirty and their vectors stay logged; retry next tick
+            print(f"Error flushing user vectors: {e}")
+
+
+def adopt_shared_user_vectors(max_age):
+    """Take over vectors other workers published in the last ``max_age`` seconds"""
+    recent = shared_user_vectors.adopt_recent(max_age)
+    for user_id, vector in recent.items():
+        username = users.username(user_id)
+        if username is not None:
+            users.set_vector(username, vector)
+            liked_cache.discard(username)
+    return len(recent)
+
+
+async def load_shared_user_vectors():
+    """Join the cross-worker user vector exchange"""
+    global shared_user_vectors
+    shared_user_vectors = SharedUserVectors(SHARED_USER_VECTORS_PATH, dim=users.dim)
+    # Listen before adopting so no publish falls between the two
+    await post_listener.add_listener(USER_VECTORS_CHANNEL, on_user_vectors)
+    # Vectors other workers published within the write-behind window may
+    # not be in Postgres yet
+    adopted = adopt_shared_user_vectors(max_age=USER_VECTOR_FLUSH_INTERVAL + 60)
+    print(f"Joined shared user vectors at {SHARED_USER_VECTORS_PATH} ({adopted} recent)")
+
+
+async def open_post_listener():
+    """Connect the notification listener, reconnecting whenever it drops"""
+    global post_listener
+    post_listener = await asyncpg.connect(**db_config)
+    await post_listener.add_listener(POST_VECTORS_CHANNEL, on_post_vectors)
+    if shared_user_vectors is not None:
+        await post_listener.add_listener(USER_VECTORS_CHANNEL, on_user_vectors)
+    post_listener.add_termination_listener(on_post_listener_lost)
+
+
+def on_post_listener_lost(conn):
+    task = asyncio.create_task(reconnect_post_listener(lost_at=time.time()))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def reconnect_post_listener(lost_at):
+    """Re-open the listener, then catch up on what it missed meanwhile"""
+    delay = LISTENER_RECONNECT_DELAY
+    while True:
+        try:
+            await open_post_listener()
+            break
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            print(f"Error reconnecting notification listener: {e}; retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, LISTENER_RECONNECT_MAX_DELAY)
+    print("Reconnected notification listener")
+
+    # Notifications sent while disconnected are gone; recover from state
+    if shared_user_vectors is not None:
+        adopt_shared_user_vectors(max_age=time.time() - lost_at + USER_VECTOR_FLUSH_INTERVAL + 60)
+    await post_index_ready.wait()
+    async with acquire_connection() as conn:
+        embedded = await conn.fetchval(
+            "SELECT array_agg(id) FROM social_search_prefs WHERE qwen_vector IS NOT NULL"
+        )
+    indexed = post_sampler.ids if FEED_RETRIEVAL == "pgvector" else post_index.ids
+    missing = np.setdiff1d(np.asarray(embedded or [], dtype=np.int64), indexed)
+    for start in range(0, len(missing), POST_LOAD_BATCH_SIZE):
+        await refresh_post_vectors(missing[start : start + POST_LOAD_BATCH_SIZE].tolist())
 
 
 @app.on_event("startup")
 async def startup_event():
-    await load_user_vectors()
+    global db_pool, user_vector_flusher
+    db_pool = await create_db_pool()
+    # Vectors a crashed process logged but never flushed win over the table
+    async with acquire_connection() as conn:
+        await user_vector_writer.recover(conn)
+    if users.max_users is None:
+        await load_users()
+    elif USER_WARMUP_USERS:
+        await load_users(limit=min(USER_WARMUP_USERS, users.max_users))
+    user_vector_flusher = asyncio.create_task(flush_user_vectors_periodically())
+    # Listen before loading so posts embedded mid-load are not missed
+    await open_post_listener()
+    if SHARED_USER_VECTORS_PATH:
+        await load_shared_user_vectors()
+    await load_liked_sets()
+    if FEED_RETRIEVAL == "pgvector":
+        await load_post_ids()
+    else:
+        await load_post_vectors()
+    post_index_ready.set()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if user_vector_flusher is not None:
+        user_vector_flusher.cancel()
+        for username in list(user_vector_writer.dirty):
+            sync_user_vector(username)
+        try:
+            async with acquire_connection() as conn:
+                await user_vector_writer.flush(conn)
+        finally:
+            user_vector_writer.close()
+    if post_listener is not None:
+        post_listener.remove_termination_listener(on_post_listener_lost)
+        await post_listener.close()
+    if shared_user_vectors is not None:
+        shared_user_vectors.close()
+    if db_pool is not None:
+        await db_pool.close()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -132,13 +1056,35 @@ async def get_html():
         <script>
             let user1Posts = [];
             let user2Posts = [];
+            // Next-page cursors from /feed; null until a feed is loaded or once it runs out
+            const feedCursors = {user1: null, user2: null};
+            const loadingMore = {user1: false, user2: false};
+
+            async function fetchLikedIds(username, posts) {
+                const response = await fetch('/liked', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        username: username,
+                        post_ids: posts.map(post => post.id)
+                    })
+                });
+                const result = await response.json();
+                return new Set(result.liked);
+            }
 
             async function loadInitialPosts() {
                 try {
                     const response = await fetch('/posts');
                     const posts = await response.json();
-                    user1Posts = posts;
-                    user2Posts = posts;
+                    const [user1Liked, user2Liked] = await Promise.all([
+                        fetchLikedIds('user1', posts),
+                        fetchLikedIds('user2', posts),
+                    ]);
+                    user1Posts = posts.map(post => ({...post, is_liked: user1Liked.has(post.id)}));
+                    user2Posts = posts.map(post => ({...post, is_liked: user2Liked.has(post.id)}));
                     await renderFeeds();
                 } catch (error) {
                     showStatus('Error loading posts: ' + error.message, true);
@@ -148,8 +1094,9 @@ async def get_html():
             async function refreshFeed(username) {
                 try {
                     showStatus(`Refreshing ${username} feed...`);
-                    const response = await fetch(`/feed/${username}`);
+                    const response = await fetch(`/feed/${username}?include_liked=true`);
                     const posts = await response.json();
+                    feedCursors[username] = response.headers.get('X-Next-Cursor');
 
                     if (username === 'user1') {
                         user1Posts = posts;
@@ -165,6 +1112,48 @@ async def get_html():
                 }
             }
 
+            async function loadMoreFeed(username) {
+                const cursor = feedCursors[username];
+                if (!cursor || loadingMore[username]) return;
+                loadingMore[username] = true;
+                try {
+                    const response = await fetch(`/feed/${username}?include_liked=true&cursor=${encodeURIComponent(cursor)}`);
+                    const posts = await response.json();
+                    if (!response.ok) {
+                        showStatus('Error: ' + posts.detail, true);
+                        return;
+                    }
+                    // Ignore a page that lands after a refresh replaced the feed
+                    if (feedCursors[username] !== cursor) return;
+                    feedCursors[username] = response.headers.get('X-Next-Cursor');
+
+                    // A like re-ranks the feed, so a later page can repeat posts already shown
+                    const shown = new Set((username === 'user1' ? user1Posts : user2Posts).map(post => post.id));
+                    const newPosts = posts.filter(post => !shown.has(post.id));
+                    const container = document.getElementById(`${username}-posts`);
+                    for (const post of newPosts) {
+                        container.appendChild(await createPostDiv(post, username));
+                    }
+                    if (username === 'user1') {
+                        user1Posts = user1Posts.concat(newPosts);
+                    } else {
+                        user2Posts = user2Posts.concat(newPosts);
+                    }
+                } catch (error) {
+                    showStatus('Error loading more posts: ' + error.message, true);
+                } finally {
+                    loadingMore[username] = false;
+                }
+            }
+
+            // Infinite scroll: fetch the next page of each feed near the bottom
+            window.addEventListener('scroll', () => {
+                if (window.innerHeight + window.scrollY >= document.body.offsetHeight - 400) {
+                    loadMoreFeed('user1');
+                    loadMoreFeed('user2');
+                }
+            });
+
             async function renderFeeds() {
                 await renderFeed('user1', user1Posts);
                 await renderFeed('user2', user2Posts);
@@ -184,15 +1173,8 @@ async def get_html():
                 const div = document.createElement('div');
                 div.className = 'post';
 
-                // Check if post is liked
-                let isLiked = false;
-                try {
-                    const response = await fetch(`/is-liked/${username}/${post.id}`);
-                    const result = await response.json();
-                    isLiked = result.is_liked;
-                } catch (error) {
-                    console.log('Error checking like status:', error);
-                }
+                // Like status is inlined by /feed or batched through /liked
+                const isLiked = Boolean(post.is_liked);
 
                 const similarityColor = post.similarity_score > 0.5 ? '#28a745' : post.similarity_score > 0.2 ? '#ffc107' : '#6c757d';
 
@@ -291,238 +1273,304 @@ async def get_html():
 
 
 @app.get("/posts")
-async def get_posts():
-    """Get a sample of posts for the frontend"""
-    conn = await get_db_connection()
-    try:
-        posts = await conn.fetch("""
-            SELECT id, title, description
-            FROM social_search_prefs
-            WHERE qwen_vector IS NOT NULL
-            ORDER BY RANDOM()
-            LIMIT 15
-        """)
+async def get_posts(username: str | None = None):
+    """Get a sample of posts for the frontend, optionally with a user's like flags"""
+    async with resident_user(username) if username is not None else nullcontext():
+        # Sample ids in memory and fetch just those rows by primary key
+        sample_ids, _ = sample_posts(FEED_SIZE)
+        async with acquire_connection() as conn:
+            posts = await conn.fetch(
+                """
+                SELECT id, title, description
+                FROM social_search_prefs
+                WHERE id = ANY($1)
+            """,
+                sample_ids.tolist(),
+            )
+
+        liked = set()
+        if username is not None:
+            liked = await fetch_liked_post_ids(username, [post["id"] for post in posts])
 
         # Add zero similarity score for initial random posts
         result = []
         for post in posts:
             post_dict = dict(post)
             post_dict['similarity_score'] = 0.0
+            if username is not None:
+                post_dict['is_liked'] = post['id'] in liked
             result.append(post_dict)
 
         return result
-    finally:
-        await conn.close()
 
 @app.get("/feed/{username}")
-async def get_personalized_feed(username: str):
-    """Get personalized feed based on user's vector similarity"""
-    if username not in user_vectors:
-        raise HTTPException(status_code=404, detail="User not found")
+async def get_personalized_feed(
+    username: str,
+    response: Response,
+    include_liked: bool = False,
+    exclude_liked: bool = False,
+    offset: int = 0,
+    limit: int = FEED_SIZE,
+    cursor: str | None = None,
+):
+    """Get personalized feed based on user's vector similarity.
+
+    Pass the X-Next-Cursor header of one page as ``cursor`` to get the next;
+    it marks the last (score, id) served, and the page continues after it
+    in the current ranking. If the ranking changed in between (e.g. the
+    user liked a post), posts whose score crossed that boundary can repeat
+    or be skipped, so clients should drop ids they already show.
+    """
+    async with resident_user(username):
+        if offset < 0 or not 1 <= limit <= FEED_MAX_PAGE_SIZE:
+            raise HTTPException(status_code=400, detail="Invalid offset or limit")
+        boundary = decode_feed_cursor(cursor) if cursor is not None else None
+
+        if not np.any(users.get_vector(username)):
+            # No preferences yet: a fresh random sample, in random order.
+            # Offsets and cursors have no order to continue, so no cursor
+            exclude = await get_liked_post_ids(username) if exclude_liked else None
+            top_ids, top_scores = sample_posts(limit, exclude)
+        else:
+            # Rank the corpus first (or reuse the cached ranking), deepening it
+            # until it covers the requested page, then fetch only that page's text
+            depth = offset + limit
+            while True:
+                ranked_ids, ranked_scores = await ranked_feed(username, depth, exclude_liked)
+                start = offset
+                if boundary is not None:
+                    start += cursor_position(ranked_ids, ranked_scores, boundary)
+                exhausted = len(ranked_ids) < depth
+                if start + limit <= len(ranked_ids) or exhausted:
+                    break
+                # Grow geometrically so a deep scroll re-ranks only a few times
+                depth = max(start + limit, 2 * len(ranked_ids))
+            top_ids = ranked_ids[start : start + limit]
+            top_scores = ranked_scores[start : start + limit]
+
+            if len(top_ids) and not (exhausted and start + limit >= len(ranked_ids)):
+                response.headers["X-Next-Cursor"] = encode_feed_cursor(
+                    top_scores[-1], top_ids[-1]
+                )
+
+        async with acquire_connection() as conn:
+            posts = await conn.fetch(
+                """
+                SELECT id, title, description
+                FROM social_search_prefs
+                WHERE id = ANY($1)
+            """,
+                top_ids.tolist(),
+            )
+        posts_by_id = {post["id"]: post for post in posts}
 
-    conn = await get_db_connection()
-    try:
-        # Get all posts with vectors
-        posts = await conn.fetch("""
-            SELECT id, title, description, qwen_vector
-            FROM social_search_prefs
-            WHERE qwen_vector IS NOT NULL
-            ORDER BY RANDOM()
-            LIMIT 100
-        """)
+        liked = set()
+        if include_liked:
+            liked = await fetch_liked_post_ids(username, list(posts_by_id))
 
-        user_vector = user_vectors[username]
         scored_posts = []
-
-        for post in posts:
-            post_vector_str = post['qwen_vector']
-            post_vector = np.array(eval(post_vector_str))
-
-            similarity = cosine_similarity(user_vector, post_vector)
-
-            scored_posts.append({
+        for post_id, similarity in zip(top_ids.tolist(), top_scores.tolist()):
+            post = posts_by_id.get(post_id)
+            if post is None:
+                continue
+            scored_post = {
                 'id': post['id'],
                 'title': post['title'],
                 'description': post['description'],
                 'similarity_score': similarity
-            })
+            }
+            if include_liked:
+                scored_post['is_liked'] = post['id'] in liked
+            scored_posts.append(scored_post)
 
-        # Sort by similarity score (highest first)
-        scored_posts.sort(key=lambda x: x['similarity_score'], reverse=True)
+        return scored_posts
+
+@app.post("/feeds/batch")
+async def get_batch_feeds(request: BatchFeedRequest):
+    """Rank feeds for many users at once, scoring them together.
+
+    Returns ranked post ids and scores per username (no post text);
+    unknown usernames are left out. For every user at once, run
+    precompute_feeds.py instead.
+    """
+    usernames = list(dict.fromkeys(request.usernames))
+    if not 1 <= len(usernames) <= BATCH_FEED_MAX_USERS:
+        raise HTTPException(
+            status_code=400, detail=f"Pass 1 to {BATCH_FEED_MAX_USERS} usernames"
+        )
+    if not 1 <= request.k <= FEED_CACHE_DEPTH:
+        raise HTTPException(status_code=400, detail="Invalid k")
+
+    # One query loads every missing profile, and one every missing liked set
+    async with resident_users(usernames) as usernames:
+        if not usernames:
+            return {"feeds": {}}
+        excludes = None
+        if request.exclude_liked:
+            excludes = await get_liked_post_ids_many(usernames)
+        vectors = np.stack([users.get_vector(username) for username in usernames])
+
+        results = await batch_search_posts(vectors, request.k, excludes)
+        feeds = {}
+        for username, (ids, scores) in zip(usernames, results):
+            feeds[username] = [
+                {"id": post_id, "similarity_score": score}
+                for post_id, score in zip(ids.tolist(), scores.tolist())
+            ]
+        return {"feeds": feeds}
 
-        return scored_posts[:15]  # Return top 15
-    finally:
-        await conn.close()
 
 @app.get("/is-liked/{username}/{post_id}")
 async def check_if_liked(username: str, post_id: int):
     """Check if a user has liked a specific post"""
-    conn = await get_db_connection()
-    try:
-        user_id = await conn.fetchval(
-            "SELECT id FROM user_prefs_api WHERE username = $1", username
-        )
+    async with resident_user(username):
+        liked = await fetch_liked_post_ids(username, [post_id])
+        return {"is_liked": post_id in liked}
 
-        if not user_id:
-            raise HTTPException(status_code=404, detail="User not found")
 
-        liked = await conn.fetchval("""
-            SELECT EXISTS(
-                SELECT 1 FROM user_likes
-                WHERE user_id = $1 AND post_id = $2
-            )
-        """, user_id, post_id)
-
-        return {"is_liked": liked}
-    finally:
-        await conn.close()
+@app.post("/liked")
+async def get_liked_posts(request: LikedStatusRequest):
+    """Return which of the given posts a user has liked, in a single query"""
+    async with resident_user(request.username):
+        liked = await fetch_liked_post_ids(request.username, request.post_ids)
+        return {"liked": sorted(liked)}
 
 
 @app.post("/like")
 async def like_post(request: LikeRequest):
     """Handle user liking a post - updates user vector"""
-    if request.username not in user_vectors:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    conn = await get_db_connection()
-    try:
-        # Get the post vector
-        post_data = await conn.fetchrow(
-            """
-            SELECT qwen_vector FROM social_search_prefs WHERE id = $1
-        """,
-            request.post_id,
-        )
-
-        if not post_data:
-            raise HTTPException(status_code=404, detail="Post not found")
-
-        # Parse post vector
-        post_vector_str = post_data["qwen_vector"]
-        post_vector = np.array(
-            eval(post_vector_str)
-        )  # In production, use proper parsing
-
-        # Get current user vector
-        current_user_vector = user_vectors[request.username]
-
-        # Exponential moving average (learning rate approach)
-        alpha = 0.15  # Learning rate - gives more weight to recent interactions
-        updated_vector = alpha * post_vector + (1 - alpha) * current_user_vector
-        user_vectors[request.username] = updated_vector
-
-        # Update database
-        updated_vector_str = "[" + ",".join(map(str, updated_vector.tolist())) + "]"
-        await conn.execute(
-            """
-            UPDATE user_prefs_api
-            SET user_vector = $1
-            WHERE username = $2
-        """,
-            updated_vector_str,
-            request.username,
-        )
-
-        # Record the like
-        user_id = await conn.fetchval(
-            "SELECT id FROM user_prefs_api WHERE username = $1", request.username
-        )
-        await conn.execute(
-            """
-            INSERT INTO user_likes (user_id, post_id)
-            VALUES ($1, $2)
-            ON CONFLICT (user_id, post_id) DO NOTHING
-        """,
-            user_id,
-            request.post_id,
-        )
+    async with resident_user(request.username):
+        async with acquire_connection() as conn:
+            # Get the post vector
+            post_data = await conn.fetchrow(
+                """
+                SELECT qwen_vector FROM social_search_prefs WHERE id = $1
+            """,
+                request.post_id,
+            )
 
-        return {
-            "message": f"User {request.username} liked post {request.post_id}. Vector updated!"
-        }
+            if not post_data:
+                raise HTTPException(status_code=404, detail="Post not found")
+
+            post_vector = post_data["qwen_vector"]
+
+            # Serialize with other workers updating this user, starting from
+            # the latest vector any of them published
+            with user_vector_lock(request.username):
+                sync_user_vector(request.username, locked=True)
+
+                # Get current user vector
+                current_user_vector = users.get_vector(request.username)
+
+                # Exponential moving average (learning rate approach)
+                alpha = 0.15  # Learning rate - gives more weight to recent interactions
+                updated_vector = alpha * post_vector + (1 - alpha) * current_user_vector
+                users.set_vector(request.username, updated_vector)
+                publish_user_vector(request.username)
+            feed_cache.invalidate(request.username)
+            # Persisted by the next write-behind flush
+            user_vector_writer.record(request.username)
+
+            # Record the like
+            await conn.execute(
+                """
+                INSERT INTO user_likes (user_id, post_id)
+                VALUES ($1, $2)
+                ON CONFLICT (user_id, post_id) DO NOTHING
+            """,
+                users.user_id(request.username),
+                request.post_id,
+            )
+            liked_cache.add(request.username, request.post_id)
+            await notify_user_vector(conn, request.username)
 
-    finally:
-        await conn.close()
+            return {
+                "message": f"User {request.username} liked post {request.post_id}. Vector updated!"
+            }
 
 @app.post("/unlike")
 async def unlike_post(request: LikeRequest):
     """Handle user unliking a post - reverses the vector operation"""
-    if request.username not in user_vectors:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    conn = await get_db_connection()
-    try:
+    async with resident_user(request.username):
         # Check if the user actually liked this post
-        user_id = await conn.fetchval(
-            "SELECT id FROM user_prefs_api WHERE username = $1", request.username
-        )
-
-        liked = await conn.fetchval("""
-            SELECT EXISTS(
-                SELECT 1 FROM user_likes
-                WHERE user_id = $1 AND post_id = $2
-            )
-        """, user_id, request.post_id)
-
+        liked = await fetch_liked_post_ids(request.username, [request.post_id])
         if not liked:
             raise HTTPException(status_code=400, detail="Post not liked by user")
 
-        # Get the post vector
-        post_data = await conn.fetchrow(
-            "SELECT qwen_vector FROM social_search_prefs WHERE id = $1",
-            request.post_id,
-        )
+        async with acquire_connection() as conn:
+            # Get the post vector
+            post_data = await conn.fetchrow(
+                "SELECT qwen_vector FROM social_search_prefs WHERE id = $1",
+                request.post_id,
+            )
 
-        if not post_data:
-            raise HTTPException(status_code=404, detail="Post not found")
+            if not post_data:
+                raise HTTPException(status_code=404, detail="Post not found")
 
-        # Parse post vector
-        post_vector_str = post_data["qwen_vector"]
-        post_vector = np.array(eval(post_vector_str))
+            post_vector = post_data["qwen_vector"]
 
-        # Get current user vector
-        current_user_vector = user_vectors[request.username]
+            with user_vector_lock(request.username):
+                sync_user_vector(request.username, locked=True)
 
-        # Reverse the exponential moving average: if new_vec = α * post_vec + (1-α) * old_vec
-        # then old_vec = (new_vec - α * post_vec) / (1-α)
-        alpha = 0.15  # Same learning rate as in like operation
-        updated_vector = (current_user_vector - alpha * post_vector) / (1 - alpha)
-        user_vectors[request.username] = updated_vector
+                # Get current user vector
+                current_user_vector = users.get_vector(request.username)
 
-        # Update database
-        updated_vector_str = "[" + ",".join(map(str, updated_vector.tolist())) + "]"
-        await conn.execute(
-            "UPDATE user_prefs_api SET user_vector = $1 WHERE username = $2",
-            updated_vector_str,
-            request.username,
-        )
+                # Reverse the exponential moving average: if new_vec = α * post_vec + (1-α) * old_vec
+                # then old_vec = (new_vec - α * post_vec) / (1-α)
+                alpha = 0.15  # Same learning rate as in like operation
+                updated_vector = (current_user_vector - alpha * post_vector) / (1 - alpha)
+                users.set_vector(request.username, updated_vector)
+                publish_user_vector(request.username)
+            feed_cache.invalidate(request.username)
+            # Persisted by the next write-behind flush
+            user_vector_writer.record(request.username)
 
-        # Remove the like record
-        await conn.execute(
-            "DELETE FROM user_likes WHERE user_id = $1 AND post_id = $2",
-            user_id,
-            request.post_id,
-        )
-
-        return {
-            "message": f"User {request.username} unliked post {request.post_id}. Vector updated!"
-        }
+            # Remove the like record
+            await conn.execute(
+                "DELETE FROM user_likes WHERE user_id = $1 AND post_id = $2",
+                users.user_id(request.username),
+                request.post_id,
+            )
+            liked_cache.remove(request.username, request.post_id)
+            await notify_user_vector(conn, request.username)
 
-    finally:
-        await conn.close()
+            return {
+                "message": f"User {request.username} unliked post {request.post_id}. Vector updated!"
+            }
 
 
 @app.get("/user/{username}/vector")
 async def get_user_vector(username: str):
     """Get current user vector (first 10 dimensions for display)"""
-    if username not in user_vectors:
-        raise HTTPException(status_code=404, detail="User not found")
+    async with resident_user(username):
+        vector = users.get_vector(username)
+        return {
+            "username": username,
+            "vector_preview": vector[:10].tolist(),
+            "vector_norm": float(np.linalg.norm(vector)),
+        }
+
+
+@app.get("/metrics/pool")
+async def get_pool_metrics():
+    """Report connection pool size and saturation"""
+    if db_pool is None:
+        raise HTTPException(status_code=503, detail="Database pool not ready")
 
-    vector = user_vectors[username]
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    acquired = pool_stats["acquired"]
     return {
-        "username": username,
-        "vector_preview": vector[:10].tolist(),
-        "vector_norm": float(np.linalg.norm(vector)),
+        "min_size": db_pool.get_min_size(),
+        "max_size": db_pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "saturation": (size - idle) / db_pool.get_max_size(),
+        "acquired": acquired,
+        "timeouts": pool_stats["timeouts"],
+        "avg_wait_ms": pool_stats["wait_seconds_total"] / acquired * 1000 if acquired else 0.0,
+        "max_wait_ms": pool_stats["wait_seconds_max"] * 1000,
     }
 
 
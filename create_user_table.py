@@ -2,6 +2,7 @@ import asyncio
 import asyncpg
 import os
 from dotenv import load_dotenv
+from snapshot_vectors import ensure_user_vector_tracking
 
 
 async def main():
@@ -80,6 +81,9 @@ async def main():
             updated_count = int(result.split()[-1])  # Extract count from "UPDATE n"
             print(f"Updated {updated_count} users to zero vectors")
 
+        # Stamp vector updates so snapshot loads can catch up incrementally
+        await ensure_user_vector_tracking(conn)
+
         # Check if user_likes table exists for tracking likes
         existing_likes_table = await conn.fetchval("""
             SELECT EXISTS (
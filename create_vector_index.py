@@ -0,0 +1,63 @@
+import asyncio
+import asyncpg
+import os
+from dotenv import load_dotenv
+
+
+async def main():
+    load_dotenv()
+
+    # Database connection parameters
+    db_config = {
+        "user": os.getenv("PSQL_DB_USERNAME"),
+        "password": os.getenv("PSQL_DB_PWD"),
+        "host": os.getenv("PSQL_DB_HOSTNAME"),
+        "database": os.getenv("PSQL_DB"),
+        "port": int(os.getenv("PSQL_DB_PORT", 5432)),
+    }
+
+    # HNSW build parameters: higher values build slower but recall better
+    hnsw_m = int(os.getenv("PGVECTOR_HNSW_M", 16))
+    hnsw_ef_construction = int(os.getenv("PGVECTOR_HNSW_EF_CONSTRUCTION", 64))
+    maintenance_work_mem = os.getenv("PGVECTOR_MAINTENANCE_WORK_MEM", "2GB")
+
+    conn = await asyncpg.connect(**db_config)
+
+    try:
+        existing_index = await conn.fetchval("""
+            SELECT EXISTS (
+                SELECT FROM pg_indexes
+                WHERE indexname = 'idx_social_search_prefs_qwen_bq_hnsw'
+            );
+        """)
+
+        if not existing_index:
+            # pgvector indexes vectors of at most 2000 dims, so index the
+            # binary quantization of the 4096-dim qwen_vector instead and let
+            # the app re-rank candidates against the full vectors
+            print(
+                f"Creating HNSW index on binary-quantized qwen_vector "
+                f"(m={hnsw_m}, ef_construction={hnsw_ef_construction})..."
+            )
+            await conn.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+            await conn.execute(f"""
+                CREATE INDEX CONCURRENTLY idx_social_search_prefs_qwen_bq_hnsw
+                ON social_search_prefs
+                USING hnsw ((binary_quantize(qwen_vector)::bit(4096)) bit_hamming_ops)
+                WITH (m = {hnsw_m:d}, ef_construction = {hnsw_ef_construction:d})
+            """)
+            print("HNSW index created!")
+        else:
+            print("HNSW index already exists.")
+
+        await conn.execute("ANALYZE social_search_prefs")
+        print("Set FEED_RETRIEVAL=pgvector to serve feeds from this index.")
+
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+import hashlib
+import re
+import sqlite3
+import unicodedata
+
+import numpy as np
+
+# SQLite caps bound parameters per statement
+_LOOKUP_CHUNK = 500
+
+
+def normalize_text(text):
+    """Canonical form of a post's text: NFC, single spaces, no outer whitespace"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by a hash of model name and text.
+
+    Backed by a local SQLite file in WAL mode so several backfill processes
+    can share it. Callers should encode the normalized text they look up,
+    so a cached vector is exactly what the model would have produced.
+    """
+
+    def __init__(self, path, model_name):
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\n{text}".encode()).digest()
+
+    def get_many(self, keys):
+        """Return {key: float32 vector} for the keys that are cached"""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), _LOOKUP_CHUNK):
+            chunk = keys[start : start + _LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float32)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [
+                (key, np.asarray(vector, dtype=np.float32).tobytes())
+                for key, vector in items
+            ],
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
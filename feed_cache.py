@@ -0,0 +1,55 @@
+from collections import OrderedDict
+
+
+class FeedCache:
+    """LRU cache of each user's ranked feeds (post ids and scores).
+
+    A user can have several rankings, one per ``variant`` (e.g. with and
+    without liked posts excluded). Each is stamped with the version it was
+    ranked at, e.g. the user's vector version and the post index generation;
+    a lookup with any other version is a miss, so a like, unlike or new
+    posts never serve a stale ranking even without an explicit ``invalidate``.
+    """
+
+    def __init__(self, max_users=10_000):
+        self.max_users = max_users
+        self._feeds = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._feeds)
+
+    def get(self, username, variant, version, depth):
+        """Return cached (ids, scores) ranked at least ``depth`` deep, or None.
+
+        A ranking shorter than the depth it was computed for means the corpus
+        ran out, so it satisfies any depth.
+        """
+        entry = self._feeds.get(username, {}).get(variant)
+        if entry is not None:
+            cached_version, ranked_depth, ids, scores = entry
+            if cached_version == version and (len(ids) >= depth or len(ids) < ranked_depth):
+                self._feeds.move_to_end(username)
+                self.hits += 1
+                return ids, scores
+        self.misses += 1
+        return None
+
+    def peek(self, username, variant):
+        """Return the cached (version, depth, ids, scores) whatever its version, or None.
+
+        Lets a caller bring an outdated ranking up to date instead of
+        ranking from scratch; it is not counted as a hit or a miss.
+        """
+        return self._feeds.get(username, {}).get(variant)
+
+    def put(self, username, variant, version, depth, ids, scores):
+        self._feeds.setdefault(username, {})[variant] = (version, depth, ids, scores)
+        self._feeds.move_to_end(username)
+        while len(self._feeds) > self.max_users:
+            self._feeds.popitem(last=False)
+
+    def invalidate(self, username):
+        """Drop every cached ranking of ``username``"""
+        self._feeds.pop(username, None)
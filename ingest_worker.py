@@ -0,0 +1,197 @@
+import asyncio
+import asyncpg
+import os
+import time
+from dotenv import load_dotenv
+from schema import find_text_columns
+from vector_codec import register_vector_codec
+from vectorize import (
+    create_staging_table,
+    embed_texts,
+    load_checkpoint,
+    load_qwen_model,
+    open_embedding_cache,
+    page_texts,
+    save_checkpoint,
+    write_embeddings,
+)
+
+load_dotenv()
+
+# Inserts into social_search_prefs wake the worker on NEW_POSTS_CHANNEL; the
+# worker announces freshly written vectors to the API on POST_VECTORS_CHANNEL
+NEW_POSTS_CHANNEL = "new_posts"
+POST_VECTORS_CHANNEL = "post_vectors"
+
+INGEST_CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT", ".ingest_checkpoint.json")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+INGEST_BATCH_DELAY = float(os.getenv("INGEST_BATCH_DELAY", 0.5))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 30))
+# Each drain re-scans this many ids below the checkpoint: a post inserted
+# by a transaction that commits after higher ids were embedded lands there
+INGEST_LAG_WINDOW = int(os.getenv("INGEST_LAG_WINDOW", 10000))
+# NOTIFY payloads must stay under 8000 bytes
+NOTIFY_PAYLOAD_LIMIT = 7900
+# Reconnect delays (seconds) after losing the database, doubling
+INGEST_RECONNECT_DELAY = 1.0
+INGEST_RECONNECT_MAX_DELAY = 60.0
+# A dropped connection, a restarting server, or a failover: worth retrying
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.OperatorInterventionError,
+)
+
+
+async def install_notify_trigger(conn):
+    """NOTIFY once per INSERT statement on social_search_prefs, not per row"""
+    await conn.execute(f"""
+        CREATE OR REPLACE FUNCTION notify_new_posts() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('{NEW_POSTS_CHANNEL}', (SELECT max(id)::text FROM new_rows));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    await conn.execute("""
+        DROP TRIGGER IF EXISTS social_search_prefs_notify_new_posts ON social_search_prefs
+    """)
+    await conn.execute("""
+        CREATE TRIGGER social_search_prefs_notify_new_posts
+        AFTER INSERT ON social_search_prefs
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_new_posts()
+    """)
+
+
+async def notify_post_vectors(conn, ids):
+    """Announce the ids of freshly written vectors, comma-separated.
+
+    Listeners fetch exactly these rows; ids that do not fit one payload
+    go out in further notifications.
+    """
+    payload = []
+    size = 0
+    for post_id in map(str, ids):
+        if payload and size + len(post_id) + 1 > NOTIFY_PAYLOAD_LIMIT:
+            await conn.execute("SELECT pg_notify($1, $2)", POST_VECTORS_CHANNEL, ",".join(payload))
+            payload = []
+            size = 0
+        payload.append(post_id)
+        size += len(post_id) + 1
+    if payload:
+        await conn.execute("SELECT pg_notify($1, $2)", POST_VECTORS_CHANNEL, ",".join(payload))
+
+
+async def ingest(db_config, model, cache):
+    """Embed new posts until the connection fails; return if there is nothing to embed"""
+    conn = await asyncpg.connect(**db_config)
+    listen_conn = None
+    try:
+        await register_vector_codec(conn)
+        listen_conn = await asyncpg.connect(**db_config)
+        await install_notify_trigger(conn)
+        await create_staging_table(conn)
+
+        available_columns = await find_text_columns(conn)
+        if not available_columns:
+            print("Error: No title, description, content, text, or body columns found!")
+            return
+        title_col = available_columns[0]
+        desc_col = available_columns[1] if len(available_columns) > 1 else None
+        select_cols = ["id", title_col] + ([desc_col] if desc_col else [])
+
+        query = f"""
+            SELECT {", ".join(select_cols)}
+            FROM social_search_prefs
+            WHERE qwen_vector IS NULL AND id > $1
+            ORDER BY id
+            LIMIT {INGEST_BATCH_SIZE}
+        """
+
+        checkpoint = load_checkpoint(INGEST_CHECKPOINT_PATH)
+        if not os.path.exists(INGEST_CHECKPOINT_PATH):
+            # Start at the newest post; vectorize.py backfills the older ones
+            checkpoint["last_id"] = await conn.fetchval(
+                "SELECT COALESCE(max(id), -1) FROM social_search_prefs"
+            )
+            save_checkpoint(checkpoint, INGEST_CHECKPOINT_PATH)
+
+        wake = asyncio.Event()
+        await listen_conn.add_listener(NEW_POSTS_CHANNEL, lambda *args: wake.set())
+        # A dead listener would leave only the poll; wake up and fail instead
+        listen_conn.add_termination_listener(lambda *args: wake.set())
+        print(f"Listening for new posts after id {checkpoint['last_id']}...")
+
+        while True:
+            if listen_conn.is_closed():
+                raise asyncpg.InterfaceError("listener connection closed")
+            # Clear before draining so inserts that land mid-drain rerun the loop
+            wake.clear()
+            # Rows still without a vector are found through the partial
+            # qwen_vector IS NULL index, so the re-scan stays cheap
+            after_id = checkpoint["last_id"] - INGEST_LAG_WINDOW
+            while batch := await conn.fetch(query, after_id):
+                ids, texts = page_texts(batch, title_col, desc_col)
+                if texts:
+                    embeddings = await asyncio.to_thread(
+                        embed_texts, model, texts, INGEST_BATCH_SIZE, cache
+                    )
+                    await write_embeddings(conn, ids, embeddings)
+                    # Let running API workers pull the new vectors into memory
+                    await notify_post_vectors(conn, ids)
+
+                after_id = batch[-1]["id"]
+                checkpoint["last_id"] = max(checkpoint["last_id"], after_id)
+                checkpoint["processed"] += len(batch)
+                save_checkpoint(checkpoint, INGEST_CHECKPOINT_PATH)
+                print(f"Embedded {len(ids)} new posts (up to id {checkpoint['last_id']})")
+
+            # Wait for an insert notification, or poll in case one was missed
+            try:
+                await asyncio.wait_for(wake.wait(), timeout=INGEST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                continue
+            # Give a burst of inserts time to land so they share a micro-batch
+            await asyncio.sleep(INGEST_BATCH_DELAY)
+    finally:
+        if listen_conn is not None:
+            listen_conn.terminate()
+        conn.terminate()
+
+
+async def main():
+    # Database connection parameters
+    db_config = {
+        "user": os.getenv("PSQL_DB_USERNAME"),
+        "password": os.getenv("PSQL_DB_PWD"),
+        "host": os.getenv("PSQL_DB_HOSTNAME"),
+        "database": os.getenv("PSQL_DB"),
+        "port": int(os.getenv("PSQL_DB_PORT", 5432)),
+    }
+
+    model = load_qwen_model()
+    cache = open_embedding_cache()
+    delay = INGEST_RECONNECT_DELAY
+
+    while True:
+        started = time.monotonic()
+        try:
+            await ingest(db_config, model, cache)
+            return
+        except TRANSIENT_ERRORS as e:
+            if time.monotonic() - started > INGEST_RECONNECT_MAX_DELAY:
+                # The last session ran fine for a while; start backing off anew
+                delay = INGEST_RECONNECT_DELAY
+            print(f"Database connection lost: {e}; reconnecting in {delay:.0f}s")
+        except Exception as e:
+            print(f"Error: {e}")
+            return
+        await asyncio.sleep(delay)
+        delay = min(2 * delay, INGEST_RECONNECT_MAX_DELAY)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
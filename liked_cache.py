@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LikedSetCache:
+    """LRU cache of each user's liked post ids as sorted int64 arrays.
+
+    Sorted arrays keep membership checks at O(log n) via ``searchsorted``
+    and cost 8 bytes per like. Users beyond ``max_users`` are evicted least
+    recently used first and reloaded from Postgres on their next request.
+
+    Every change is stamped, for uncached users too, so a fill read from
+    Postgres before a concurrent like or unlike can be recognized as stale:
+    take ``stamp()`` before the query and pass it to ``put``.
+    """
+
+    def __init__(self, max_users=100_000):
+        self.max_users = max_users
+        self._sets = OrderedDict()
+        self._clock = 0
+        self._changes = OrderedDict()
+        # Stamps of users pruned from _changes are at most this
+        self._forgotten = 0
+
+    def __len__(self):
+        return len(self._sets)
+
+    def __contains__(self, username):
+        return username in self._sets
+
+    def get(self, username):
+        """Return the user's sorted liked ids, or None if not cached"""
+        liked = self._sets.get(username)
+        if liked is not None:
+            self._sets.move_to_end(username)
+        return liked
+
+    def _changed(self, username):
+        self._clock += 1
+        self._changes[username] = self._clock
+        self._changes.move_to_end(username)
+        while len(self._changes) > self.max_users:
+            _, self._forgotten = self._changes.popitem(last=False)
+
+    def stamp(self):
+        """Token for a fill about to be read from the database"""
+        return self._clock
+
+    def put(self, username, post_ids, stamp=None):
+        """Cache the user's likes; return False if dropped as stale.
+
+        With ``stamp``, the fill is dropped if the user's likes changed
+        after it was taken.
+        """
+        if stamp is not None and self._changes.get(username, self._forgotten) > stamp:
+            return False
+        self._sets[username] = np.unique(np.asarray(post_ids, dtype=np.int64))
+        self._sets.move_to_end(username)
+        while len(self._sets) > self.max_users:
+            self._sets.popitem(last=False)
+        return True
+
+    def discard(self, username):
+        """Forget a user's likes, e.g. after another process changed them"""
+        self._sets.pop(username, None)
+        self._changed(username)
+
+    def contains(self, username, post_id):
+        """Membership check; None means the user is not cached"""
+        liked = self.get(username)
+        if liked is None:
+            return None
+        pos = np.searchsorted(liked, post_id)
+        return bool(pos < len(liked) and liked[pos] == post_id)
+
+    def add(self, username, post_id):
+        """Write-through for a new like (only stamped for uncached users)"""
+        self._changed(username)
+        liked = self.get(username)
+        if liked is None:
+            return
+        pos = np.searchsorted(liked, post_id)
+        if pos < len(liked) and liked[pos] == post_id:
+            return
+        self._sets[username] = np.insert(liked, pos, post_id)
+
+    def remove(self, username, post_id):
+        """Write-through for an unlike (only stamped for uncached users)"""
+        self._changed(username)
+        liked = self.get(username)
+        if liked is None:
+            return
+        pos = np.searchsorted(liked, post_id)
+        if pos < len(liked) and liked[pos] == post_id:
+            self._sets[username] = np.delete(liked, pos)
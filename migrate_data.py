@@ -1,193 +1,270 @@
 import asyncio
 import asyncpg
 import os
+import time
 from dotenv import load_dotenv
+from schema import (
+    SOURCE_TABLE,
+    copied_columns,
+    create_indexes,
+    ensure_target_table,
+    find_time_column,
+    get_table_spec,
+    quote_identifier,
+)
 
-async def main():
-    load_dotenv()
+POST_LIMIT = 700000
 
-    # Database connection parameters
-    db_config = {
-        'user': os.getenv('PSQL_DB_USERNAME'),
-        'password': os.getenv('PSQL_DB_PWD'),
-        'host': os.getenv('PSQL_DB_HOSTNAME'),
-        'database': os.getenv('PSQL_DB'),
-        'port': int(os.getenv('PSQL_DB_PORT', 5432))
-    }
 
-    conn = await asyncpg.connect(**db_config)
+async def plan_chunks(conn, time_column, chunks):
+    """Split the newest POST_LIMIT source rows into time ranges of equal size.
+
+    The plan is stored in social_search_prefs_migration so an interrupted
+    migration resumes with the same ranges. Each chunk covers
+    ``lower <= time < upper``, with no upper bound for the newest chunk.
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS social_search_prefs_migration (
+            chunk INTEGER PRIMARY KEY,
+            lower_bound TEXT NOT NULL,
+            upper_bound TEXT,
+            rows_copied BIGINT,
+            done_at TIMESTAMP
+        )
+    """)
+
+    existing = await conn.fetchval('SELECT COUNT(*) FROM social_search_prefs_migration')
+    if existing:
+        print(f"Resuming existing {existing}-chunk migration plan")
+        return
+
+    # Bounds are kept as text and cast back to the column's type in queries
+    bounds = await conn.fetch(f"""
+        SELECT min({time_column})::text AS lower_bound
+        FROM (
+            SELECT {time_column}, ntile($1) OVER (ORDER BY {time_column} DESC) AS tile
+            FROM (
+                SELECT {time_column} FROM social_search_2
+                WHERE {time_column} IS NOT NULL
+                ORDER BY {time_column} DESC
+                LIMIT {POST_LIMIT}
+            ) newest
+        ) tiles
+        GROUP BY tile
+        ORDER BY tile
+    """, chunks)
+
+    upper = None
+    for chunk, row in enumerate(bounds):
+        await conn.execute(
+            'INSERT INTO social_search_prefs_migration (chunk, lower_bound, upper_bound) VALUES ($1, $2, $3)',
+            chunk, row['lower_bound'], upper,
+        )
+        upper = row['lower_bound']
+
+
+async def copy_chunk(pool, chunk, columns, columns_str, time_column, time_type, copy_format):
+    """Stream one time range from social_search_2 into social_search_prefs.
+
+    Rows flow through COPY TO on one connection and COPY FROM on another
+    without being materialized. The chunk is marked done in the same
+    transaction as the insert, so a failed chunk leaves nothing behind.
+    """
+    where = f'{time_column} >= $1::text::{time_type}'
+    args = [chunk['lower_bound']]
+    if chunk['upper_bound'] is not None:
+        where += f' AND {time_column} < $2::text::{time_type}'
+        args.append(chunk['upper_bound'])
+
+    async with pool.acquire() as src, pool.acquire() as dst:
+        buffer = asyncio.Queue(maxsize=64)
+
+        async def produce():
+            try:
+                await src.copy_from_query(
+                    f'SELECT {columns_str} FROM social_search_2 WHERE {where}',
+                    *args,
+                    output=buffer.put,
+                    format=copy_format,
+                )
+            finally:
+                await buffer.put(None)
+
+        async def consume():
+            while (data := await buffer.get()) is not None:
+                yield data
+
+        async with dst.transaction():
+            # If either side fails, the task group cancels the other
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(produce())
+                copy_task = tg.create_task(
+                    dst.copy_to_table(
+                        'social_search_prefs',
+                        source=consume(),
+                        columns=columns,
+                        format=copy_format,
+                    )
+                )
+            rows = int(copy_task.result().split()[-1])  # Extract count from "COPY n"
+            await dst.execute(
+                'UPDATE social_search_prefs_migration SET rows_copied = $2, done_at = NOW() WHERE chunk = $1',
+                chunk['chunk'], rows,
+            )
+    return rows
+
+
+async def migrate_chunked(conn, db_config, columns, columns_str, time_column, chunks, workers):
+    """Copy the newest POST_LIMIT posts in parallel, resumable time chunks"""
+    time_sql = quote_identifier(time_column)
+    await plan_chunks(conn, time_sql, chunks)
+
+    time_type = await conn.fetchval("""
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'social_search_2'::regclass AND attname = $1
+    """, time_column)
+
+    # Binary COPY needs identical column types on both sides; fall back to
+    # text when the type mapping widened any column (e.g. to TEXT)
+    type_query = """
+        SELECT attname, format_type(atttypid, atttypmod) AS type FROM pg_attribute
+        WHERE attrelid = $1::regclass AND attnum > 0 AND NOT attisdropped
+    """
+    source_types = {r['attname']: r['type'] for r in await conn.fetch(type_query, 'social_search_2')}
+    target_types = {r['attname']: r['type'] for r in await conn.fetch(type_query, 'social_search_prefs')}
+    same_types = all(source_types[c] == target_types.get(c) for c in columns)
+    copy_format = 'binary' if same_types else 'text'
+    print(f"Using {copy_format} COPY across {workers} parallel workers")
+
+    pending = await conn.fetch(
+        'SELECT * FROM social_search_prefs_migration WHERE done_at IS NULL ORDER BY chunk'
+    )
+    total_chunks = await conn.fetchval('SELECT COUNT(*) FROM social_search_prefs_migration')
+    done_chunks = total_chunks - len(pending)
+    copied = 0
+    start = time.monotonic()
+
+    pool = await asyncpg.create_pool(**db_config, min_size=2 * workers, max_size=2 * workers)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(chunk):
+        nonlocal copied, done_chunks
+        async with semaphore:
+            rows = await copy_chunk(
+                pool, chunk, columns, columns_str, time_sql, time_type, copy_format
+            )
+        copied += rows
+        done_chunks += 1
+        elapsed = time.monotonic() - start
+        print(
+            f"Chunk {chunk['chunk']} done ({rows} rows). "
+            f"Progress: {done_chunks}/{total_chunks} chunks, {copied} rows, {copied / elapsed:.0f} rows/s"
+        )
 
     try:
-        # First, get the structure of social_search_2 table
-        print("Getting structure of social_search_2 table...")
-        table_info = await conn.fetch("""
-            SELECT column_name, data_type, character_maximum_length, is_nullable, column_default
-            FROM information_schema.columns
-            WHERE table_name = 'social_search_2'
-            ORDER BY ordinal_position;
-        """)
-
-        if not table_info:
-            print("Error: social_search_2 table not found!")
-            return
-
-        # Check if social_search_prefs already exists
-        existing_table = await conn.fetchval("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = 'social_search_prefs'
-            );
-        """)
-
-        if not existing_table:
-            print("Creating social_search_prefs table...")
-            print("Table structure from social_search_2:")
-            for col in table_info:
-                print(f"  {col['column_name']}: {col['data_type']}")
-
-            # Build CREATE TABLE statement based on social_search_2 structure
-            columns = []
-            excluded_columns = ['canonical_url', 'vsearch', 'minilm_vectors', 'blip_vector']
-
-            for col in table_info:
-                col_name = col['column_name']
-
-                # Skip excluded columns
-                if col_name in excluded_columns:
-                    continue
-
-                data_type = col['data_type']
-                max_length = col['character_maximum_length']
-                is_nullable = col['is_nullable']
-                default_val = col['column_default']
-
-                # Handle reserved keywords by quoting them
-                if col_name.upper() in ['USER', 'ORDER', 'GROUP', 'SELECT', 'FROM', 'WHERE']:
-                    col_name = f'"{col_name}"'
-
-                # Handle different data types
-                if data_type == 'character varying' and max_length:
-                    col_def = f"{col_name} VARCHAR({max_length})"
-                elif data_type == 'text':
-                    col_def = f"{col_name} TEXT"
-                elif data_type == 'integer':
-                    col_def = f"{col_name} INTEGER"
-                elif data_type == 'bigint':
-                    col_def = f"{col_name} BIGINT"
-                elif data_type == 'timestamp without time zone':
-                    col_def = f"{col_name} TIMESTAMP"
-                elif data_type == 'timestamp with time zone':
-                    col_def = f"{col_name} TIMESTAMPTZ"
-                elif data_type == 'boolean':
-                    col_def = f"{col_name} BOOLEAN"
-                elif data_type == 'numeric':
-                    col_def = f"{col_name} NUMERIC"
-                elif data_type == 'real':
-                    col_def = f"{col_name} REAL"
-                elif data_type == 'double precision':
-                    col_def = f"{col_name} DOUBLE PRECISION"
-                elif data_type == 'jsonb':
-                    col_def = f"{col_name} JSONB"
-                elif data_type == 'json':
-                    col_def = f"{col_name} JSON"
-                elif data_type == 'ARRAY':
-                    col_def = f"{col_name} TEXT[]"
-                else:
-                    col_def = f"{col_name} TEXT"
-
-                if is_nullable == 'NO':
-                    col_def += " NOT NULL"
-
-                if default_val and 'nextval' not in default_val:
-                    col_def += f" DEFAULT {default_val}"
-
-                columns.append(col_def)
-
-            # Add the new qwen_vector column
-            columns.append("qwen_vector vector(4096)")
-
-            create_table_sql = f"""
-                CREATE TABLE social_search_prefs (
-                    {', '.join(columns)}
-                );
-            """
+        await asyncio.gather(*(run(chunk) for chunk in pending))
+    finally:
+        await pool.close()
 
-            print(f"CREATE TABLE SQL: {create_table_sql}")
-            await conn.execute(create_table_sql)
-            print("social_search_prefs table created successfully!")
-        else:
-            print("social_search_prefs table already exists.")
-            # Check if qwen_vector column exists and has correct type
-            qwen_col = await conn.fetchval("""
-                SELECT data_type FROM information_schema.columns
-                WHERE table_name = 'social_search_prefs' AND column_name = 'qwen_vector'
-            """)
-
-            if qwen_col != 'USER-DEFINED':
-                print("Updating qwen_vector column to vector(4096) type...")
-                if qwen_col:
-                    # Column exists but wrong type, drop and recreate
-                    await conn.execute("ALTER TABLE social_search_prefs DROP COLUMN qwen_vector")
-                # Add the vector column
-                await conn.execute("ALTER TABLE social_search_prefs ADD COLUMN qwen_vector vector(4096)")
-                print("qwen_vector column updated successfully!")
-
-        # Check current count in social_search_prefs
-        current_count = await conn.fetchval("SELECT COUNT(*) FROM social_search_prefs")
-        print(f"Current records in social_search_prefs: {current_count}")
-
-        # Check if we need to copy data
-        if current_count == 0:
-            print("Copying last 700k posts from social_search_2...")
-
-            # First, let's check what columns exist and find the time column
-            time_column = None
-            for col in table_info:
-                col_name = col['column_name'].lower()
-                if 'time' in col_name or 'date' in col_name or 'created' in col_name:
-                    time_column = col['column_name']
-                    break
-
-            if not time_column:
-                print("Warning: Could not identify time column. Using first column for ordering.")
-                time_column = table_info[0]['column_name']
-
-            print(f"Using column '{time_column}' for time-based ordering")
-
-            # Copy data with LIMIT 700000 ordered by time DESC
-            excluded_columns = ['canonical_url', 'vsearch', 'minilm_vectors', 'blip_vector']
-            column_names = []
-            for col in table_info:
-                col_name = col['column_name']
-                # Skip excluded columns
-                if col_name in excluded_columns:
-                    continue
-                if col_name.upper() in ['USER', 'ORDER', 'GROUP', 'SELECT', 'FROM', 'WHERE']:
-                    col_name = f'"{col_name}"'
-                column_names.append(col_name)
-            columns_str = ', '.join(column_names)
 
+async def migrate_posts(conn, db_config):
+    """Create social_search_prefs, copy the newest posts into it and index it.
+
+    Returns False when the source table is missing.
+    """
+    # First, get the structure of social_search_2 table
+    print("Getting structure of social_search_2 table...")
+    table_info = await get_table_spec(conn, SOURCE_TABLE)
+
+    if not table_info:
+        print("Error: social_search_2 table not found!")
+        return False
+
+    await ensure_target_table(conn, table_info)
+
+    time_column = find_time_column(table_info)
+    print(f"Using column '{time_column}' for time-based ordering")
+
+    # Check current count in social_search_prefs
+    current_count = await conn.fetchval("SELECT COUNT(*) FROM social_search_prefs")
+    print(f"Current records in social_search_prefs: {current_count}")
+
+    # A chunked migration that was interrupted still has pending chunks
+    migrate_chunks = int(os.getenv('MIGRATE_CHUNKS', 1))
+    pending_chunks = 0
+    if current_count == 0:
+        # Nothing copied yet, so any old plan is stale
+        await conn.execute('DROP TABLE IF EXISTS social_search_prefs_migration')
+    elif await conn.fetchval("SELECT to_regclass('social_search_prefs_migration') IS NOT NULL"):
+        # Checked whatever MIGRATE_CHUNKS is now: a plain copy on top of a
+        # partial chunked one would skip or duplicate rows
+        pending_chunks = await conn.fetchval(
+            'SELECT COUNT(*) FROM social_search_prefs_migration WHERE done_at IS NULL'
+        )
+
+    # Check if we need to copy data
+    if current_count == 0 or pending_chunks:
+        print("Copying last 700k posts from social_search_2...")
+
+        # Copy data with LIMIT 700000 ordered by time DESC
+        raw_column_names = copied_columns(table_info)
+        columns_str = ', '.join(quote_identifier(name) for name in raw_column_names)
+
+        if migrate_chunks > 1 or pending_chunks:
+            if migrate_chunks <= 1:
+                print(f"Resuming the {pending_chunks} pending chunks of an interrupted chunked migration")
+            await migrate_chunked(
+                conn,
+                db_config,
+                raw_column_names,
+                columns_str,
+                time_column,
+                migrate_chunks,
+                int(os.getenv('MIGRATE_WORKERS', 4)),
+            )
+        else:
             copy_sql = f"""
                 INSERT INTO social_search_prefs ({columns_str})
                 SELECT {columns_str}
                 FROM social_search_2
-                ORDER BY {time_column} DESC
-                LIMIT 700000;
+                ORDER BY {quote_identifier(time_column)} DESC
+                LIMIT {POST_LIMIT};
             """
 
             print("Executing data copy... This may take a while.")
             await conn.execute(copy_sql)
 
-            # Verify the copy
-            final_count = await conn.fetchval("SELECT COUNT(*) FROM social_search_prefs")
-            print(f"Data copy completed! Records copied: {final_count}")
-        else:
-            print(f"Table already has {current_count} records. Skipping data copy.")
+        # Verify the copy
+        final_count = await conn.fetchval("SELECT COUNT(*) FROM social_search_prefs")
+        print(f"Data copy completed! Records copied: {final_count}")
+    else:
+        print(f"Table already has {current_count} records. Skipping data copy.")
+
+    # Indexes go on after the bulk copy, which is faster than maintaining them
+    await create_indexes(conn, time_column)
+    return True
+
 
+async def main():
+    load_dotenv()
+
+    # Database connection parameters
+    db_config = {
+        'user': os.getenv('PSQL_DB_USERNAME'),
+        'password': os.getenv('PSQL_DB_PWD'),
+        'host': os.getenv('PSQL_DB_HOSTNAME'),
+        'database': os.getenv('PSQL_DB'),
+        'port': int(os.getenv('PSQL_DB_PORT', 5432))
+    }
+
+    conn = await asyncpg.connect(**db_config)
+
+    try:
+        await migrate_posts(conn, db_config)
     except Exception as e:
         print(f"Error: {e}")
     finally:
         await conn.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,560 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+from snapshot import page_vectors, read_snapshot
+
+# Keyset page of embedded posts, for page_vectors
+POST_PAGE_QUERY = """
+    SELECT id, qwen_vector AS vector
+    FROM social_search_prefs
+    WHERE qwen_vector IS NOT NULL AND id > $1
+    ORDER BY id
+    LIMIT $2
+"""
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row in place, leaving all-zero rows untouched"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k(scores, k):
+    """Positions of the ``k`` highest finite scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(scores[top])[::-1]]
+    return top[np.isfinite(scores[top])]
+
+
+def sample_ids(rng, ids, k, exclude=None):
+    """Draw ``k`` distinct entries of ``ids`` uniformly, skipping ``exclude``.
+
+    Drawing ``k + len(exclude)`` entries and dropping excluded ones still
+    leaves ``k`` whenever that many exist, without touching every id.
+    """
+    n_exclude = 0 if exclude is None else len(exclude)
+    picked = ids[rng.choice(len(ids), size=min(len(ids), k + n_exclude), replace=False)]
+    if n_exclude:
+        picked = picked[~np.isin(picked, exclude)]
+    return picked[:k]
+
+
+class PostIdSampler:
+    """Sorted ids of embedded posts, for exploration feeds without vectors"""
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.rng = np.random.default_rng()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, ids):
+        self.ids = np.unique(np.asarray(ids, dtype=np.int64))
+
+    def add(self, ids):
+        self.ids = np.union1d(self.ids, np.asarray(ids, dtype=np.int64))
+
+    def sample(self, k, exclude=None):
+        """Return ``k`` random post ids with zero scores (cold-start feed)"""
+        ids = sample_ids(self.rng, self.ids, k, exclude)
+        return ids, np.zeros(len(ids), dtype=np.float32)
+
+
+class PostIndex:
+    """Resident float32 matrix of L2-normalized post embeddings.
+
+    Rows of ``matrix`` line up with ``ids``, so a feed request is one
+    matrix-vector product followed by an ``argpartition`` top-k. Rows stay
+    in insertion order; ``_sorted_ids``/``_order`` (ids ascending and their
+    rows) find a post's row by bisection without ever moving the matrix.
+    """
+
+    # Scores are exact cosines, so results need no re-ranking
+    approximate = False
+
+    def __init__(self, dim=4096):
+        self.dim = dim
+        self.storage_dim = dim
+        self.storage_dtype = np.float32
+        # Backing arrays may have spare capacity; only the first ``size``
+        # rows are live, exposed through ``ids`` and ``matrix``
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self.size = 0
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)
+        self.rng = np.random.default_rng()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def ids(self):
+        return self._ids[: self.size]
+
+    @property
+    def matrix(self):
+        return self._matrix[: self.size]
+
+    def fit(self, sample):
+        """Learn any encoding parameters from a sample of raw post vectors"""
+
+    def encode(self, vectors):
+        """Convert raw post vectors into stored rows (L2-normalized float32)"""
+        return normalize_rows(np.array(vectors, dtype=np.float32))
+
+    def load(self, ids, matrix, size=None):
+        """Replace the index contents with already-encoded rows.
+
+        With ``size``, only the first ``size`` rows are live and the rest is
+        spare capacity that appends fill in place (e.g. in a snapshot map).
+        """
+        self._ids = np.asarray(ids, dtype=np.int64)
+        self._matrix = matrix
+        self.size = len(self._ids) if size is None else size
+        # Already the identity for sorted ids (e.g. a snapshot)
+        self._order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._order]
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._ids):
+            return
+        # Grow by 25% rather than doubling: the matrix can be many GB
+        capacity = max(capacity, len(self._ids) * 5 // 4 + 1024)
+        ids = np.empty(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, self._matrix.shape[1]), dtype=self._matrix.dtype)
+        ids[: self.size] = self.ids
+        matrix[: self.size] = self.matrix
+        self._ids = ids
+        self._matrix = matrix
+
+    def _find(self, ids):
+        """Bisect sorted ``ids`` into the id lookup: (insertion points, found mask)"""
+        pos = np.searchsorted(self._sorted_ids, ids)
+        found = pos < self.size
+        found[found] = self._sorted_ids[pos[found]] == ids[found]
+        return pos, found
+
+    def upsert(self, ids, rows):
+        """Insert or overwrite already-encoded rows for ``ids``.
+
+        New ids are appended whatever their order, in amortized O(batch)
+        matrix writes; only the O(n) id lookup is merged. Existing rows
+        never move. Returns the positions of the written rows.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids)
+        ids, rows = ids[order], rows[order]
+
+        pos, existing = self._find(ids)
+        written = self._order[pos[existing]]
+        self._matrix[written] = rows[existing]
+
+        new_ids, new_rows = ids[~existing], rows[~existing]
+        if len(new_ids) == 0:
+            return written
+
+        start = self.size
+        self._reserve(start + len(new_ids))
+        self._ids[start : start + len(new_ids)] = new_ids
+        self._matrix[start : start + len(new_ids)] = new_rows
+        self.size += len(new_ids)
+        appended = np.arange(start, self.size)
+        # Ascending new ids have non-decreasing insertion points, so one
+        # insert keeps the lookup sorted
+        self._sorted_ids = np.insert(self._sorted_ids, pos[~existing], new_ids)
+        self._order = np.insert(self._order, pos[~existing], appended)
+        return np.concatenate([written, appended])
+
+    def remove(self, post_ids):
+        """Drop the rows of ``post_ids``; return how many were indexed.
+
+        Compacts the matrix into a fresh copy, so this suits rare removals
+        (e.g. posts whose embedding was cleared), not a steady stream.
+        """
+        rows = self.rows_for(post_ids)
+        if len(rows):
+            keep = np.ones(self.size, dtype=bool)
+            keep[rows] = False
+            self.load(self.ids[keep], self.matrix[keep])
+        return len(rows)
+
+    def rows_for(self, post_ids):
+        """Map post ids to matrix rows, dropping ids that are not indexed"""
+        post_ids = np.asarray(post_ids, dtype=np.int64)
+        pos, found = self._find(post_ids)
+        return self._order[pos[found]]
+
+    def sample(self, k, exclude=None):
+        """Return ``k`` random post ids with zero scores (cold-start feed)"""
+        ids = sample_ids(self.rng, self.ids, k, exclude)
+        return ids, np.zeros(len(ids), dtype=np.float32)
+
+    def search(self, query, k, exclude=None):
+        """Return the ids and cosine scores of the ``k`` best posts for ``query``.
+
+        Post ids in ``exclude`` (e.g. already-liked posts) are never returned.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or len(self) == 0:
+            # A zero vector scores every post equally; explore instead
+            return self.sample(k, exclude)
+
+        scores = self.score(query / norm)
+        if exclude is not None and len(exclude):
+            scores[self.rows_for(exclude)] = -np.inf
+
+        top = top_k(scores, k)
+        return self.ids[top], scores[top]
+
+    def score(self, query):
+        """Score every row against a unit-length query"""
+        return self.matrix @ query
+
+    def prepare_queries(self, queries):
+        """Map unit-length queries into the space ``score_rows`` works in"""
+        return queries
+
+    def score_rows(self, start, stop, queries):
+        """Score rows ``start:stop`` against prepared queries, one row per query"""
+        return queries @ self.matrix[start:stop].T
+
+    def search_many(self, queries, k, excludes=None, query_block=256, row_block=16384):
+        """Return [(ids, scores)] of the ``k`` best posts for each query.
+
+        Queries are scored against the corpus as blocked matrix products:
+        each block of ``query_block`` queries sweeps the rows ``row_block``
+        at a time, keeping a running top-k per query, so the score buffer
+        stays query_block x row_block however many users and posts there
+        are. ``excludes`` holds one array of post ids to skip per query (or
+        None). Scores are exact for every index except approximate ones,
+        whose stored rows are scored as-is; IVF lists are not probed.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        results = []
+        for q_start in range(0, len(queries), query_block):
+            block = queries[q_start : q_start + query_block]
+            block_excludes = (
+                [None] * len(block)
+                if excludes is None
+                else excludes[q_start : q_start + query_block]
+            )
+            results.extend(self._search_block(block, k, block_excludes, row_block))
+        return results
+
+    def _search_block(self, queries, k, excludes, row_block):
+        norms = np.linalg.norm(queries, axis=1)
+        live = np.flatnonzero(norms > 0) if len(self) else np.empty(0, dtype=np.int64)
+        results = [None] * len(queries)
+        # A zero vector scores every post equally; explore instead
+        for i in np.setdiff1d(np.arange(len(queries)), live).tolist():
+            results[i] = self.sample(k, excludes[i])
+        k = min(k, len(self))
+        if len(live) == 0 or k <= 0:
+            return [result or self.sample(0) for result in results]
+
+        prepared = self.prepare_queries(queries[live] / norms[live, None])
+        # (query, row) pairs to mask out, as flat positions per query
+        excluded_queries, excluded_rows = [], []
+        for pos, i in enumerate(live.tolist()):
+            if excludes[i] is not None and len(excludes[i]):
+                rows = self.rows_for(excludes[i])
+                excluded_queries.append(np.full(len(rows), pos))
+                excluded_rows.append(rows)
+        excluded_queries = np.concatenate(excluded_queries or [np.empty(0, dtype=np.int64)])
+        excluded_rows = np.concatenate(excluded_rows or [np.empty(0, dtype=np.int64)])
+
+        best_scores = np.full((len(live), k), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(live), k), dtype=np.int64)
+        for start in range(0, len(self), row_block):
+            stop = min(start + row_block, len(self))
+            scores = self.score_rows(start, stop, prepared)
+            masked = (excluded_rows >= start) & (excluded_rows < stop)
+            scores[excluded_queries[masked], excluded_rows[masked] - start] = -np.inf
+
+            # Merge the block into the running top-k of every query at once
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_rows = np.concatenate(
+                [best_rows, np.broadcast_to(np.arange(start, stop), scores.shape)], axis=1
+            )
+            top = np.argpartition(merged_scores, -k, axis=1)[:, -k:]
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_rows = np.take_along_axis(merged_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        for pos, i in enumerate(live.tolist()):
+            keep = np.isfinite(best_scores[pos])
+            results[i] = self.ids[best_rows[pos][keep]], best_scores[pos][keep]
+        return results
+
+
+class IVFPostIndex(PostIndex):
+    """PostIndex with an inverted-file coarse quantizer for approximate search.
+
+    Rows are clustered with spherical k-means into ``nlist`` lists; a query
+    only scores the rows in its ``nprobe`` closest lists. Raising ``nprobe``
+    trades latency for recall, up to exact search at ``nprobe == nlist``.
+    """
+
+    def __init__(self, dim=4096, nlist=512, nprobe=16, train_size=20000, iterations=10):
+        super().__init__(dim)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.iterations = iterations
+        self.centroids = np.empty((0, dim), dtype=np.float32)
+        self.assignments = np.empty(0, dtype=np.int64)
+        self.list_rows = np.empty(0, dtype=np.int64)
+        self.list_offsets = np.zeros(1, dtype=np.int64)
+
+    def load(self, ids, matrix, size=None):
+        super().load(ids, matrix, size)
+        self.build()
+
+    def upsert(self, ids, rows):
+        written = super().upsert(ids, rows)
+        if len(self.centroids) == 0:
+            # There were too few rows to train on before
+            self.build()
+            return written
+
+        # Bucket the written rows under the existing centroids
+        assignments = np.empty(self.size, dtype=np.int64)
+        assignments[: len(self.assignments)] = self.assignments
+        assignments[written] = np.argmax(self.matrix[written] @ self.centroids.T, axis=1)
+        self._set_lists(assignments)
+        return written
+
+    def _set_lists(self, assignments):
+        self.assignments = assignments
+        self.list_rows = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(assignments, minlength=len(self.centroids))))
+        )
+
+    def build(self, block_size=65536):
+        """Train centroids on a sample and bucket every row into its list"""
+        n = len(self)
+        nlist = min(self.nlist, n)
+        if nlist == 0:
+            return
+
+        train = self.matrix[self.rng.choice(n, size=min(self.train_size, n), replace=False)]
+        centroids = train[self.rng.choice(len(train), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assign = np.argmax(train @ centroids.T, axis=1)
+            order = np.argsort(assign, kind="stable")
+            clusters, starts = np.unique(assign[order], return_index=True)
+            # Empty clusters keep their previous centroid
+            centroids[clusters] = np.add.reduceat(train[order], starts, axis=0)
+            normalize_rows(centroids)
+
+        self.centroids = centroids
+        self._set_lists(self._assign(centroids, block_size))
+
+    def _assign(self, centroids, block_size=65536):
+        """Closest centroid of every row, computed blockwise"""
+        assignments = np.empty(len(self), dtype=np.int64)
+        for start in range(0, len(self), block_size):
+            block = self.matrix[start : start + block_size]
+            assignments[start : start + block_size] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def search(self, query, k, exclude=None):
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or len(self.centroids) == 0:
+            return self.sample(k, exclude)
+        query = query / norm
+
+        centroid_scores = self.centroids @ query
+        nprobe = min(self.nprobe, len(centroid_scores))
+        probes = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        rows = np.concatenate(
+            [self.list_rows[self.list_offsets[c] : self.list_offsets[c + 1]] for c in probes]
+        )
+
+        scores = self.matrix[rows] @ query
+        if exclude is not None and len(exclude):
+            scores[np.isin(self.ids[rows], exclude)] = -np.inf
+
+        top = top_k(scores, k)
+        return self.ids[rows[top]], scores[top]
+
+
+class CompressedPostIndex(PostIndex):
+    """PostIndex that stores reduced and/or int8-quantized post embeddings.
+
+    ``reduce`` is ``"truncate"`` (keep the leading ``reduced_dim`` Matryoshka
+    dimensions of the Qwen3 embedding and renormalize) or ``"pca"`` (project
+    onto the top ``reduced_dim`` principal directions of a sample); with
+    ``quantize`` each stored dimension is further scaled to int8. Scores are
+    approximate, so callers should re-rank the top candidates against the
+    full vectors.
+    """
+
+    approximate = True
+
+    def __init__(
+        self, dim=4096, reduce="truncate", reduced_dim=1024, quantize=True, block_size=16384
+    ):
+        if reduce not in ("none", "truncate", "pca"):
+            raise ValueError(f"Unknown reduction: {reduce}")
+        super().__init__(dim)
+        self.reduce = reduce
+        self.storage_dim = dim if reduce == "none" else min(reduced_dim, dim)
+        self.storage_dtype = np.int8 if quantize else np.float32
+        self.quantize = quantize
+        self.block_size = block_size
+        self._matrix = np.empty((0, self.storage_dim), dtype=self.storage_dtype)
+        self.components = None
+        self.scales = np.ones(self.storage_dim, dtype=np.float32)
+
+    def _reduce(self, vectors):
+        vectors = normalize_rows(np.array(vectors, dtype=np.float32, ndmin=2))
+        if self.reduce == "truncate":
+            return normalize_rows(np.ascontiguousarray(vectors[:, : self.storage_dim]))
+        if self.reduce == "pca":
+            # Uncentered projection preserves dot products with the query
+            return vectors @ self.components
+        return vectors
+
+    def fit(self, sample):
+        if self.reduce == "pca":
+            sample = normalize_rows(np.array(sample, dtype=np.float32))
+            _, _, vt = np.linalg.svd(sample, full_matrices=False)
+            self.components = np.ascontiguousarray(vt[: self.storage_dim].T)
+            self.storage_dim = self.components.shape[1]
+        if self.quantize:
+            peaks = np.abs(self._reduce(sample)).max(axis=0)
+            peaks[peaks == 0] = 1.0
+            self.scales = (peaks / 127).astype(np.float32)
+
+    def encode(self, vectors):
+        reduced = self._reduce(vectors)
+        if not self.quantize:
+            return reduced
+        return np.clip(np.rint(reduced / self.scales), -127, 127).astype(np.int8)
+
+    def prepare_queries(self, queries):
+        # Fold the int8 scales into the queries so rows are only upcast blockwise
+        return self._reduce(queries) * self.scales
+
+    def score_rows(self, start, stop, queries):
+        return queries @ self.matrix[start:stop].astype(np.float32).T
+
+    def score(self, query):
+        # Fold the int8 scales into the query so rows are only upcast blockwise
+        query = self._reduce(query)[0] * self.scales
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.block_size):
+            block = self.matrix[start : start + self.block_size]
+            scores[start : start + self.block_size] = block.astype(np.float32) @ query
+        return scores
+
+
+async def load_post_index(index, conn, snapshot_path=None, batch_size=10000):
+    """Fill ``index`` with every embedded post in social_search_prefs.
+
+    Maps the snapshot at ``snapshot_path`` when there is one and catches it
+    up on posts changed since; otherwise pages every vector from the table.
+    """
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        if await _load_post_snapshot(index, conn, snapshot_path, batch_size):
+            return
+        print(f"{snapshot_path} has no update watermark; re-run snapshot_vectors.py")
+
+    total = await conn.fetchval(
+        "SELECT COUNT(*) FROM social_search_prefs WHERE qwen_vector IS NOT NULL"
+    )
+    ids = np.empty(total, dtype=np.int64)
+    matrix = None
+    filled = 0
+    async for rows in page_vectors(conn, POST_PAGE_QUERY, batch_size, limit=total):
+        page = np.stack([row["vector"] for row in rows])
+        if matrix is None:
+            # Encoders like PCA and int8 learn their parameters from the first page
+            index.fit(page)
+            matrix = np.empty((total, index.storage_dim), dtype=index.storage_dtype)
+        ids[filled : filled + len(rows)] = [row["id"] for row in rows]
+        matrix[filled : filled + len(rows)] = index.encode(page)
+        filled += len(rows)
+
+    if matrix is None:
+        matrix = np.empty((0, index.storage_dim), dtype=index.storage_dtype)
+    index.load(ids[:filled], matrix[:filled])
+    print(
+        f"Loaded {len(index)} post vectors into memory "
+        f"({index.matrix.nbytes / 2**20:.0f} MiB)"
+    )
+
+
+async def _load_post_snapshot(index, conn, path, batch_size):
+    """Map a post snapshot into ``index``, then catch up on changes since.
+
+    Returns False, loading nothing, for a snapshot without an update-time
+    watermark (taken before post vectors were tracked).
+    """
+    header, ids, matrix = read_snapshot(path, spare=True)
+    if not isinstance(header.get("watermark"), str):
+        return False
+    watermark = datetime.fromisoformat(header["watermark"])
+    if type(index).encode is PostIndex.encode:
+        # Snapshot rows are already normalized float32, exactly what this
+        # index stores, so serve straight from the page cache; processes
+        # mapping the same file share one copy, and new posts fill the
+        # snapshot's spare rows rather than forcing a private copy
+        index.load(ids, matrix, size=header["rows"])
+    elif header["rows"]:
+        ids, matrix = ids[: header["rows"]], matrix[: header["rows"]]
+        index.fit(matrix[:batch_size])
+        storage = np.empty((len(ids), index.storage_dim), dtype=index.storage_dtype)
+        for start in range(0, len(ids), batch_size):
+            storage[start : start + batch_size] = index.encode(matrix[start : start + batch_size])
+        index.load(np.array(ids), storage)
+    ids = ids[: header["rows"]]
+
+    embedded = await conn.fetchval(
+        "SELECT array_agg(id ORDER BY id) FROM social_search_prefs WHERE qwen_vector IS NOT NULL"
+    )
+    changed = await conn.fetchval(
+        """
+        SELECT array_agg(id)
+        FROM social_search_prefs
+        WHERE qwen_vector IS NOT NULL AND qwen_vector_updated_at > $1
+    """,
+        watermark,
+    )
+    embedded = np.asarray(embedded or [], dtype=np.int64)
+    # Posts embedded after the snapshot (new ids or backfilled older ones)
+    # and posts re-embedded since
+    stale = np.union1d(np.setdiff1d(embedded, ids), np.asarray(changed or [], dtype=np.int64))
+    rows = []
+    for start in range(0, len(stale), batch_size):
+        rows += await conn.fetch(
+            "SELECT id, qwen_vector FROM social_search_prefs WHERE id = ANY($1)",
+            stale[start : start + batch_size].tolist(),
+        )
+    # Posts whose embedding was cleared since
+    removed = index.remove(np.setdiff1d(ids, embedded))
+    if rows:
+        vectors = np.stack([row["qwen_vector"] for row in rows])
+        if len(index) == 0:
+            index.fit(vectors)
+        index.upsert([row["id"] for row in rows], index.encode(vectors))
+    print(
+        f"Loaded {len(index)} post vectors from {path} "
+        f"({len(rows)} read from the database, {removed} dropped)"
+    )
+    return True
@@ -0,0 +1,142 @@
+import asyncio
+import asyncpg
+import os
+from datetime import datetime, timezone
+import numpy as np
+from dotenv import load_dotenv
+from post_index import PostIndex, load_post_index
+from vector_codec import register_vector_codec
+
+
+async def ensure_feed_table(conn):
+    """Create precomputed_feeds: each user's top posts, best first"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS precomputed_feeds (
+            user_id INTEGER NOT NULL REFERENCES user_prefs_api(id) ON DELETE CASCADE,
+            rank INTEGER NOT NULL,
+            post_id BIGINT NOT NULL,
+            score REAL NOT NULL,
+            computed_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (user_id, rank)
+        )
+    """)
+
+
+async def fetch_user_block(conn, last_id, block_size, usernames):
+    """Next block of users after ``last_id`` in id order, optionally filtered by name"""
+    return await conn.fetch(
+        """
+        SELECT id, user_vector
+        FROM user_prefs_api
+        WHERE id > $1 AND ($3::text[] IS NULL OR username = ANY($3))
+        ORDER BY id
+        LIMIT $2
+    """,
+        last_id,
+        block_size,
+        usernames,
+    )
+
+
+async def fetch_liked(conn, user_ids):
+    """Liked post ids of each user in ``user_ids``"""
+    rows = await conn.fetch(
+        """
+        SELECT user_id, array_agg(post_id) AS post_ids
+        FROM user_likes
+        WHERE user_id = ANY($1)
+        GROUP BY user_id
+    """,
+        user_ids,
+    )
+    liked = {row["user_id"]: np.array(row["post_ids"], dtype=np.int64) for row in rows}
+    return [liked.get(user_id) for user_id in user_ids]
+
+
+async def write_feeds(conn, user_ids, results, computed_at):
+    """Replace the block's users' feeds in one transaction"""
+    records = [
+        (user_id, rank, post_id, score, computed_at)
+        for user_id, (ids, scores) in zip(user_ids, results)
+        for rank, (post_id, score) in enumerate(zip(ids.tolist(), scores.tolist()))
+    ]
+    async with conn.transaction():
+        await conn.execute("DELETE FROM precomputed_feeds WHERE user_id = ANY($1)", user_ids)
+        await conn.copy_records_to_table(
+            "precomputed_feeds",
+            records=records,
+            columns=["user_id", "rank", "post_id", "score", "computed_at"],
+        )
+
+
+async def main():
+    load_dotenv()
+
+    # Database connection parameters
+    db_config = {
+        "user": os.getenv("PSQL_DB_USERNAME"),
+        "password": os.getenv("PSQL_DB_PWD"),
+        "host": os.getenv("PSQL_DB_HOSTNAME"),
+        "database": os.getenv("PSQL_DB"),
+        "port": int(os.getenv("PSQL_DB_PORT", 5432)),
+    }
+
+    feed_depth = int(os.getenv("PRECOMPUTE_FEED_DEPTH", 300))
+    # Users fetched, scored and written per round trip
+    user_block = int(os.getenv("PRECOMPUTE_USER_BLOCK", 1024))
+    # Users and posts per matrix product; the score buffer is their product
+    query_block = int(os.getenv("PRECOMPUTE_QUERY_BLOCK", 256))
+    row_block = int(os.getenv("PRECOMPUTE_ROW_BLOCK", 16384))
+    exclude_liked = os.getenv("PRECOMPUTE_EXCLUDE_LIKED", "1") == "1"
+    # Comma-separated usernames; every user when unset
+    usernames = os.getenv("PRECOMPUTE_USERNAMES")
+    usernames = [name.strip() for name in usernames.split(",")] if usernames else None
+    snapshot_path = os.path.join(os.getenv("SNAPSHOT_DIR", "snapshots"), "posts.snap")
+    batch_size = int(os.getenv("SNAPSHOT_BATCH_SIZE", 10000))
+
+    conn = await asyncpg.connect(**db_config)
+    await register_vector_codec(conn)
+
+    try:
+        await ensure_feed_table(conn)
+
+        print("Loading post vectors...")
+        index = PostIndex()
+        await load_post_index(index, conn, snapshot_path, batch_size)
+        computed_at = datetime.now(timezone.utc)
+
+        print("Scoring users...")
+        written = 0
+        last_id = -1
+        while True:
+            rows = await fetch_user_block(conn, last_id, user_block, usernames)
+            if not rows:
+                break
+            user_ids = [row["id"] for row in rows]
+            queries = np.stack([row["user_vector"] for row in rows])
+            excludes = await fetch_liked(conn, user_ids) if exclude_liked else None
+
+            # The matrix products release the GIL; keep the event loop free
+            results = await asyncio.to_thread(
+                index.search_many,
+                queries,
+                feed_depth,
+                excludes,
+                query_block=query_block,
+                row_block=row_block,
+            )
+            await write_feeds(conn, user_ids, results, computed_at)
+            written += len(rows)
+            last_id = user_ids[-1]
+            print(f"  {written} users")
+
+        print(f"Precomputed feeds for {written} users")
+
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,196 @@
+import re
+
+import asyncpg
+
+SOURCE_TABLE = "social_search_2"
+TARGET_TABLE = "social_search_prefs"
+
+# Columns of the source table that are not carried over
+EXCLUDED_COLUMNS = {"canonical_url", "vsearch", "minilm_vectors", "blip_vector"}
+
+RESERVED_WORDS = {
+    "USER", "ORDER", "GROUP", "SELECT", "FROM", "WHERE", "TABLE", "LIMIT",
+    "OFFSET", "DESC", "ASC", "END", "DEFAULT", "CHECK", "COLUMN", "PRIMARY",
+}
+
+# information_schema data_type -> column type in social_search_prefs;
+# anything not listed is copied as TEXT
+TYPE_MAP = {
+    "text": "TEXT",
+    "smallint": "SMALLINT",
+    "integer": "INTEGER",
+    "bigint": "BIGINT",
+    "date": "DATE",
+    "timestamp without time zone": "TIMESTAMP",
+    "timestamp with time zone": "TIMESTAMPTZ",
+    "boolean": "BOOLEAN",
+    "numeric": "NUMERIC",
+    "real": "REAL",
+    "double precision": "DOUBLE PRECISION",
+    "jsonb": "JSONB",
+    "json": "JSON",
+    "uuid": "UUID",
+    "ARRAY": "TEXT[]",
+}
+
+TIME_TYPES = {"timestamp without time zone", "timestamp with time zone", "date"}
+
+# Preferred names for the post time column, best first
+TIME_COLUMN_NAMES = [
+    "created_at", "published_at", "posted_at", "timestamp", "time", "date", "created",
+]
+
+# Columns usable as post text for embedding, best first
+TEXT_COLUMN_NAMES = ["title", "description", "content", "text", "body"]
+
+_spec_cache = {}
+
+
+async def get_table_spec(conn, table, refresh=False):
+    """Columns of ``table`` in ordinal order, introspected once per process"""
+    if refresh or table not in _spec_cache:
+        _spec_cache[table] = await conn.fetch("""
+            SELECT column_name, data_type, character_maximum_length, is_nullable, column_default
+            FROM information_schema.columns
+            WHERE table_name = $1
+            ORDER BY ordinal_position
+        """, table)
+    return _spec_cache[table]
+
+
+def quote_identifier(name):
+    if re.fullmatch(r"[a-z_][a-z0-9_]*", name) and name.upper() not in RESERVED_WORDS:
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+def column_definition(col):
+    """DDL for one source column as it should appear in social_search_prefs"""
+    data_type = col["data_type"]
+    if data_type == "character varying" and col["character_maximum_length"]:
+        col_type = f"VARCHAR({col['character_maximum_length']})"
+    else:
+        col_type = TYPE_MAP.get(data_type, "TEXT")
+
+    col_def = f"{quote_identifier(col['column_name'])} {col_type}"
+    if col["is_nullable"] == "NO":
+        col_def += " NOT NULL"
+    default_val = col["column_default"]
+    if default_val and "nextval" not in default_val:
+        col_def += f" DEFAULT {default_val}"
+    return col_def
+
+
+def copied_columns(spec):
+    """Names of the source columns that are copied into social_search_prefs"""
+    return [col["column_name"] for col in spec if col["column_name"] not in EXCLUDED_COLUMNS]
+
+
+def find_time_column(spec):
+    """Pick the column that orders posts by recency.
+
+    Prefers columns with a timestamp/date type, ranked by TIME_COLUMN_NAMES,
+    then falls back to a name match on any type, then the first column.
+    """
+    def rank(col):
+        name = col["column_name"].lower()
+        return TIME_COLUMN_NAMES.index(name) if name in TIME_COLUMN_NAMES else len(TIME_COLUMN_NAMES)
+
+    typed = [col for col in spec if col["data_type"] in TIME_TYPES]
+    if typed:
+        return min(typed, key=rank)["column_name"]
+
+    named = [col for col in spec if rank(col) < len(TIME_COLUMN_NAMES)]
+    if named:
+        return min(named, key=rank)["column_name"]
+
+    print("Warning: Could not identify time column. Using first column for ordering.")
+    return spec[0]["column_name"]
+
+
+async def find_text_columns(conn):
+    """Text columns of social_search_prefs usable for embedding, best first"""
+    names = {col["column_name"] for col in await get_table_spec(conn, TARGET_TABLE)}
+    return [name for name in TEXT_COLUMN_NAMES if name in names]
+
+
+async def ensure_target_table(conn, source_spec):
+    """Create social_search_prefs from the source spec, or repair qwen_vector"""
+    target_spec = await get_table_spec(conn, TARGET_TABLE)
+
+    if not target_spec:
+        print(f"Creating {TARGET_TABLE} table...")
+        print(f"Table structure from {SOURCE_TABLE}:")
+        for col in source_spec:
+            print(f"  {col['column_name']}: {col['data_type']}")
+
+        columns = [
+            column_definition(col)
+            for col in source_spec
+            if col["column_name"] not in EXCLUDED_COLUMNS
+        ]
+        # Add the new qwen_vector column
+        columns.append("qwen_vector vector(4096)")
+
+        create_table_sql = f"""
+            CREATE TABLE {TARGET_TABLE} (
+                {", ".join(columns)}
+            );
+        """
+        print(f"CREATE TABLE SQL: {create_table_sql}")
+        await conn.execute(create_table_sql)
+        print(f"{TARGET_TABLE} table created successfully!")
+    else:
+        print(f"{TARGET_TABLE} table already exists.")
+        # Check if qwen_vector column exists and has correct type
+        qwen_col = next(
+            (col["data_type"] for col in target_spec if col["column_name"] == "qwen_vector"),
+            None,
+        )
+        if qwen_col != "USER-DEFINED":
+            print("Updating qwen_vector column to vector(4096) type...")
+            if qwen_col:
+                # Column exists but wrong type, drop and recreate
+                await conn.execute(f"ALTER TABLE {TARGET_TABLE} DROP COLUMN qwen_vector")
+            # Add the vector column
+            await conn.execute(f"ALTER TABLE {TARGET_TABLE} ADD COLUMN qwen_vector vector(4096)")
+            print("qwen_vector column updated successfully!")
+
+    await get_table_spec(conn, TARGET_TABLE, refresh=True)
+
+
+async def create_indexes(conn, time_column):
+    """Create the indexes the API and backfill hot paths rely on (idempotent)"""
+    has_primary_key = await conn.fetchval(f"""
+        SELECT EXISTS (
+            SELECT FROM pg_index
+            WHERE indrelid = '{TARGET_TABLE}'::regclass AND indisprimary
+        )
+    """)
+    if not has_primary_key:
+        print(f"Adding primary key on {TARGET_TABLE}(id)...")
+        try:
+            await conn.execute(f"ALTER TABLE {TARGET_TABLE} ADD PRIMARY KEY (id)")
+        except asyncpg.PostgresError as e:
+            # Duplicate or NULL ids in the source: settle for a plain index
+            print(f"Warning: could not add primary key ({e}); indexing id instead")
+            await conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{TARGET_TABLE}_id ON {TARGET_TABLE}(id)"
+            )
+
+    quoted_time = quote_identifier(time_column)
+    await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TARGET_TABLE}_time
+        ON {TARGET_TABLE}({quoted_time} DESC)
+    """)
+    # Keyset scans over embedded posts (API load) and unembedded posts (backfill)
+    await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TARGET_TABLE}_embedded_id
+        ON {TARGET_TABLE}(id) WHERE qwen_vector IS NOT NULL
+    """)
+    await conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TARGET_TABLE}_unembedded_id
+        ON {TARGET_TABLE}(id) WHERE qwen_vector IS NULL
+    """)
+    await conn.execute(f"ANALYZE {TARGET_TABLE}")
+    print(f"{TARGET_TABLE} indexes are in place.")
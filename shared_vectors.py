@@ -0,0 +1,114 @@
+import fcntl
+import mmap
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+class SharedUserVectors:
+    """User vectors exchanged between worker processes through a shared file.
+
+    Slot ``user_id`` of the memory-mapped file holds (seq, written_at,
+    vector). A worker that changes a user's vector ``publish``es it under
+    that slot's file lock, bumping ``seq``; other workers adopt the slot
+    via ``newer`` once they see a seq above the last one they took. Put
+    the file on tmpfs (e.g. /dev/shm) so it never outlives a reboot.
+    """
+
+    def __init__(self, path, dim=4096, capacity=1024):
+        self.path = path
+        self._record = np.dtype(
+            [("seq", "<i8"), ("written_at", "<f8"), ("vector", "<f4", (dim,))]
+        )
+        self.seen = {}
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._mmap = None
+        self.slots = None
+        if os.fstat(self._fd).st_size < capacity * self._record.itemsize:
+            self._grow(capacity)
+        self._remap()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _remap(self):
+        size = os.fstat(self._fd).st_size
+        size -= size % self._record.itemsize
+        # The old mapping is released once no array views of it remain
+        self._mmap = mmap.mmap(self._fd, size)
+        self.slots = np.frombuffer(self._mmap, dtype=self._record)
+
+    def _grow(self, capacity):
+        # Whole-file lock so concurrent growers cannot shrink each other
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            size = capacity * self._record.itemsize
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _slot(self, user_id):
+        if user_id >= len(self.slots):
+            # Another worker may already have grown the file
+            if os.fstat(self._fd).st_size < (user_id + 1) * self._record.itemsize:
+                self._grow(max(user_id + 1, 2 * len(self.slots)))
+            self._remap()
+        return self.slots[user_id]
+
+    @contextmanager
+    def lock(self, user_id, exclusive=True):
+        """Hold the slot's file lock, serializing updates across processes"""
+        self._slot(user_id)
+        offset = user_id * self._record.itemsize
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        fcntl.lockf(self._fd, mode, self._record.itemsize, offset, os.SEEK_SET)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self._record.itemsize, offset, os.SEEK_SET)
+
+    def publish(self, user_id, vector):
+        """Write the user's new vector; call while holding ``lock(user_id)``"""
+        slot = self._slot(user_id)
+        slot["vector"] = vector
+        slot["written_at"] = time.time()
+        slot["seq"] += 1
+        self.seen[user_id] = int(slot["seq"])
+
+    def newer(self, user_id, locked=False):
+        """Return the slot's vector if another worker published one since we last looked.
+
+        Pass ``locked=True`` when already holding ``lock(user_id)``: POSIX
+        locks do not nest, so taking it again would release it.
+        """
+        with nullcontext() if locked else self.lock(user_id, exclusive=False):
+            slot = self._slot(user_id)
+            seq = int(slot["seq"])
+            if seq <= self.seen.get(user_id, 0):
+                return None
+            self.seen[user_id] = seq
+            return slot["vector"].copy()
+
+    def forget(self, user_id):
+        """Make ``newer`` return the slot's vector again, e.g. after reloading the user"""
+        self.seen.pop(user_id, None)
+
+    def adopt_recent(self, max_age):
+        """Mark every slot seen; return {user_id: vector} of those written within max_age.
+
+        Run at startup after loading users: slots younger than the
+        write-behind window may not have reached Postgres yet.
+        """
+        self._remap()
+        written = np.flatnonzero(self.slots["seq"] > 0)
+        self.seen.update(zip(written.tolist(), self.slots["seq"][written].tolist()))
+        recent = written[self.slots["written_at"][written] >= time.time() - max_age]
+        return {int(user_id): self.slots["vector"][user_id].copy() for user_id in recent}
+
+    def close(self):
+        self.slots = None
+        self._mmap = None
+        os.close(self._fd)
@@ -0,0 +1,127 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+# File layout: a HEADER_SIZE block holding MAGIC, a little-endian uint32
+# length and a JSON header; then the int64 id index at ``ids_offset``; then
+# the row-major matrix at ``matrix_offset``. Sections are page aligned so
+# both can be memory-mapped in place.
+MAGIC = b"PFESNAP1"
+HEADER_SIZE = 4096
+_ALIGN = 4096
+_LENGTH = struct.Struct("<I")
+_ID_DTYPE = np.dtype("<i8")
+
+
+def _align(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+class SnapshotWriter:
+    """Build a snapshot file in place, published atomically on ``commit``.
+
+    ``ids`` and ``matrix`` are writable memory maps with room for
+    ``capacity`` rows; fill the first ``rows`` of each, sorted by id, then
+    call ``commit(rows, ...)``. With ``spare`` the file keeps room for that
+    many more rows, which readers can map and append to in place.
+    """
+
+    def __init__(self, path, capacity, dim, dtype=np.float32, spare=0):
+        self.path = path
+        self.spare = spare
+        self.tmp_path = f"{path}.tmp"
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.ids_offset = HEADER_SIZE
+        self.matrix_offset = _align(HEADER_SIZE + (capacity + spare) * _ID_DTYPE.itemsize)
+        with open(self.tmp_path, "wb") as f:
+            f.truncate(self.matrix_offset + capacity * dim * self.dtype.itemsize)
+        if capacity:
+            self.ids = np.memmap(
+                self.tmp_path, dtype=_ID_DTYPE, mode="r+",
+                offset=self.ids_offset, shape=(capacity,),
+            )
+            self.matrix = np.memmap(
+                self.tmp_path, dtype=self.dtype, mode="r+",
+                offset=self.matrix_offset, shape=(capacity, dim),
+            )
+        else:
+            self.ids = np.empty(0, dtype=_ID_DTYPE)
+            self.matrix = np.empty((0, dim), dtype=self.dtype)
+
+    def commit(self, rows, **meta):
+        """Write the header for the first ``rows`` rows and publish the file"""
+        header = {
+            "rows": rows,
+            "capacity": rows + self.spare,
+            "dim": self.dim,
+            "dtype": self.dtype.str,
+            "ids_offset": self.ids_offset,
+            "matrix_offset": self.matrix_offset,
+            **meta,
+        }
+        encoded = json.dumps(header).encode()
+        if len(MAGIC) + _LENGTH.size + len(encoded) > HEADER_SIZE:
+            raise ValueError("snapshot header too large")
+
+        for array in (self.ids, self.matrix):
+            if isinstance(array, np.memmap):
+                array.flush()
+        self.ids = self.matrix = None
+        with open(self.tmp_path, "r+b") as f:
+            f.write(MAGIC + _LENGTH.pack(len(encoded)) + encoded)
+            # Size the matrix for ``rows`` plus spare rows; the spare tail
+            # stays sparse on disk until written
+            capacity = rows + self.spare
+            f.truncate(self.matrix_offset + capacity * self.dim * self.dtype.itemsize)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+        return header
+
+
+def read_snapshot(path, mode="c", spare=False):
+    """Memory-map a snapshot; return (header, ids, matrix).
+
+    The default copy-on-write mode lets callers update rows in memory
+    without touching the file, while every process mapping the same file
+    shares the pages it has not written. With ``spare``, the arrays also
+    cover the spare capacity after the ``header["rows"]`` live rows.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+        header = json.loads(f.read(length))
+
+    rows, dim, dtype = header["rows"], header["dim"], np.dtype(header["dtype"])
+    if spare:
+        rows = header.get("capacity", rows)
+    if rows == 0:
+        return header, np.empty(0, dtype=_ID_DTYPE), np.empty((0, dim), dtype=dtype)
+    ids = np.memmap(path, dtype=_ID_DTYPE, mode=mode, offset=header["ids_offset"], shape=(rows,))
+    matrix = np.memmap(
+        path, dtype=dtype, mode=mode, offset=header["matrix_offset"], shape=(rows, dim)
+    )
+    return header, ids, matrix
+
+
+async def page_vectors(conn, query, batch_size, limit=None):
+    """Yield pages of rows in id order, by keyset pagination.
+
+    ``query`` takes the last id seen and a page size as $1 and $2 and
+    must select ``id`` ordered by it; keyset pages stay index range scans
+    however deep they go. Stops after ``limit`` rows when given.
+    """
+    fetched = 0
+    last_id = -1
+    while limit is None or fetched < limit:
+        size = batch_size if limit is None else min(batch_size, limit - fetched)
+        rows = await conn.fetch(query, last_id, size)
+        if not rows:
+            break
+        yield rows
+        fetched += len(rows)
+        last_id = rows[-1]["id"]
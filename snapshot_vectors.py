@@ -0,0 +1,173 @@
+import asyncio
+import asyncpg
+import os
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from dotenv import load_dotenv
+from post_index import POST_PAGE_QUERY, normalize_rows
+from snapshot import SnapshotWriter, page_vectors
+from vector_codec import register_vector_codec
+
+# Spare rows reserved in the post snapshot, as a fraction of its size, so
+# app workers can index new posts in the shared map without copying it
+POST_SNAPSHOT_SPARE = 0.1
+
+# Vectors updated this long before a snapshot started are re-read on load
+# anyway, covering transactions still in flight while it was taken
+WATERMARK_MARGIN = timedelta(minutes=5)
+
+
+async def ensure_user_vector_tracking(conn):
+    """Stamp user_prefs_api rows with the time their vector last changed"""
+    await conn.execute("""
+        ALTER TABLE user_prefs_api
+        ADD COLUMN IF NOT EXISTS vector_updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_prefs_api_vector_updated_at
+        ON user_prefs_api(vector_updated_at)
+    """)
+    await conn.execute("""
+        CREATE OR REPLACE FUNCTION touch_user_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.vector_updated_at := NOW();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    await conn.execute("""
+        DROP TRIGGER IF EXISTS user_prefs_api_touch_user_vector ON user_prefs_api
+    """)
+    await conn.execute("""
+        CREATE TRIGGER user_prefs_api_touch_user_vector
+        BEFORE UPDATE OF user_vector ON user_prefs_api
+        FOR EACH ROW EXECUTE FUNCTION touch_user_vector()
+    """)
+
+
+async def ensure_post_vector_tracking(conn):
+    """Stamp social_search_prefs rows with the time their embedding last changed"""
+    await conn.execute("""
+        ALTER TABLE social_search_prefs
+        ADD COLUMN IF NOT EXISTS qwen_vector_updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    """)
+    await conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_social_search_prefs_qwen_vector_updated_at
+        ON social_search_prefs(qwen_vector_updated_at)
+    """)
+    await conn.execute("""
+        CREATE OR REPLACE FUNCTION touch_post_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.qwen_vector_updated_at := NOW();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    await conn.execute("""
+        DROP TRIGGER IF EXISTS social_search_prefs_touch_post_vector ON social_search_prefs
+    """)
+    await conn.execute("""
+        CREATE TRIGGER social_search_prefs_touch_post_vector
+        BEFORE UPDATE OF qwen_vector ON social_search_prefs
+        FOR EACH ROW EXECUTE FUNCTION touch_post_vector()
+    """)
+
+
+async def copy_vectors(conn, writer, query, batch_size, normalize=False):
+    """Page (id, vector) rows in id order into a snapshot; return the row count"""
+    filled = 0
+    async for rows in page_vectors(conn, query, batch_size, limit=len(writer.ids)):
+        page = np.stack([row["vector"] for row in rows])
+        writer.ids[filled : filled + len(rows)] = [row["id"] for row in rows]
+        writer.matrix[filled : filled + len(rows)] = normalize_rows(page) if normalize else page
+        filled += len(rows)
+        print(f"  {filled}/{len(writer.ids)} rows")
+    return filled
+
+
+async def snapshot_posts(conn, path, batch_size):
+    """Snapshot L2-normalized post embeddings, watermarked by their last update time"""
+    # One consistent view for the count and every page
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        watermark = await conn.fetchval("SELECT NOW() - $1::interval", WATERMARK_MARGIN)
+        total = await conn.fetchval(
+            "SELECT COUNT(*) FROM social_search_prefs WHERE qwen_vector IS NOT NULL"
+        )
+        writer = SnapshotWriter(
+            path, total, 4096, spare=int(total * POST_SNAPSHOT_SPARE) + 1024
+        )
+        rows = await copy_vectors(conn, writer, POST_PAGE_QUERY, batch_size, normalize=True)
+    return writer.commit(
+        rows,
+        kind="posts",
+        watermark=watermark.isoformat(),
+        created_at=datetime.now(timezone.utc).isoformat(),
+    )
+
+
+async def snapshot_users(conn, path, batch_size):
+    """Snapshot raw user vectors, watermarked by their last update time"""
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        watermark = await conn.fetchval("SELECT NOW() - $1::interval", WATERMARK_MARGIN)
+        total = await conn.fetchval("SELECT COUNT(*) FROM user_prefs_api")
+        writer = SnapshotWriter(path, total, 4096)
+        rows = await copy_vectors(
+            conn,
+            writer,
+            """
+            SELECT id, user_vector AS vector
+            FROM user_prefs_api
+            WHERE id > $1
+            ORDER BY id
+            LIMIT $2
+        """,
+            batch_size,
+        )
+    return writer.commit(
+        rows,
+        kind="users",
+        watermark=watermark.isoformat(),
+        created_at=datetime.now(timezone.utc).isoformat(),
+    )
+
+
+async def main():
+    load_dotenv()
+
+    # Database connection parameters
+    db_config = {
+        "user": os.getenv("PSQL_DB_USERNAME"),
+        "password": os.getenv("PSQL_DB_PWD"),
+        "host": os.getenv("PSQL_DB_HOSTNAME"),
+        "database": os.getenv("PSQL_DB"),
+        "port": int(os.getenv("PSQL_DB_PORT", 5432)),
+    }
+
+    snapshot_dir = os.getenv("SNAPSHOT_DIR", "snapshots")
+    batch_size = int(os.getenv("SNAPSHOT_BATCH_SIZE", 10000))
+    os.makedirs(snapshot_dir, exist_ok=True)
+
+    conn = await asyncpg.connect(**db_config)
+    await register_vector_codec(conn)
+
+    try:
+        # The app catches vectors up by their update time
+        await ensure_user_vector_tracking(conn)
+        await ensure_post_vector_tracking(conn)
+
+        print("Snapshotting user vectors...")
+        header = await snapshot_users(conn, os.path.join(snapshot_dir, "users.snap"), batch_size)
+        print(f"Wrote {header['rows']} user vectors (watermark {header['watermark']})")
+
+        print("Snapshotting post vectors...")
+        header = await snapshot_posts(conn, os.path.join(snapshot_dir, "posts.snap"), batch_size)
+        print(f"Wrote {header['rows']} post vectors (watermark {header['watermark']})")
+
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class UserRegistry:
+    """In-memory user profiles keyed by username.
+
+    Each user owns one dense row of ``matrix`` (float32 user vectors);
+    ``user_ids`` and ``created_at`` are parallel per-row arrays, so resolving
+    a username to its database id or vector is a single dict lookup.
+    ``versions`` stamps each row with a registry-wide counter on every
+    write, so caches derived from a vector can tell when it changed, even
+    across an eviction and reload.
+
+    With ``max_users`` the registry is an LRU: ``touch`` marks a user
+    recently used and ``evict`` drops the least recently used users beyond
+    the limit, freeing their rows for reuse.
+    """
+
+    def __init__(self, dim=4096, capacity=16, max_users=None):
+        self.dim = dim
+        self.max_users = max_users
+        self.rows = OrderedDict()
+        self.usernames = [None] * capacity
+        self.by_id = {}
+        self.free_rows = list(range(capacity - 1, -1, -1))
+        self.user_ids = np.empty(capacity, dtype=np.int64)
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.matrix = np.empty((capacity, dim), dtype=np.float32)
+        self.created_at = [None] * capacity
+        self._clock = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, username):
+        return username in self.rows
+
+    def _grow(self, capacity):
+        user_ids = np.empty(capacity, dtype=np.int64)
+        versions = np.zeros(capacity, dtype=np.int64)
+        matrix = np.empty((capacity, self.dim), dtype=np.float32)
+        n = len(self.user_ids)
+        user_ids[:n] = self.user_ids
+        versions[:n] = self.versions
+        matrix[:n] = self.matrix
+        self.user_ids = user_ids
+        self.versions = versions
+        self.matrix = matrix
+        self.usernames.extend([None] * (capacity - n))
+        self.created_at.extend([None] * (capacity - n))
+        self.free_rows.extend(range(capacity - 1, n - 1, -1))
+
+    def _stamp(self, row):
+        self._clock += 1
+        self.versions[row] = self._clock
+
+    def add(self, username, user_id, vector, created_at=None):
+        """Register a user (or overwrite an existing one) and return its row"""
+        row = self.rows.get(username)
+        if row is None:
+            if not self.free_rows:
+                size = len(self.user_ids)
+                if self.max_users is not None:
+                    # Evicting keeps the registry near max_users, so grow up to it
+                    self._grow(max(size + 16, min(2 * size, self.max_users)))
+                else:
+                    self._grow(max(16, 2 * size))
+            row = self.free_rows.pop()
+            self.usernames[row] = username
+        self.rows[username] = row
+        self.rows.move_to_end(username)
+        self.created_at[row] = created_at
+        self.user_ids[row] = user_id
+        self.by_id[int(user_id)] = username
+        self.matrix[row] = vector
+        self._stamp(row)
+        return row
+
+    def touch(self, username):
+        """Mark the user most recently used"""
+        self.rows.move_to_end(username)
+
+    def remove(self, username):
+        row = self.rows.pop(username)
+        del self.by_id[int(self.user_ids[row])]
+        self.usernames[row] = None
+        self.created_at[row] = None
+        self.free_rows.append(row)
+
+    def evict(self, pinned=()):
+        """Drop least recently used users beyond max_users; return their usernames.
+
+        Users in ``pinned`` (e.g. vectors not yet persisted) are kept even
+        if that leaves the registry over its limit.
+        """
+        if self.max_users is None:
+            return []
+        evicted = []
+        excess = len(self) - self.max_users
+        for username in self.rows:
+            if len(evicted) >= excess:
+                break
+            if username not in pinned:
+                evicted.append(username)
+        for username in evicted:
+            self.remove(username)
+        return evicted
+
+    def user_id(self, username):
+        return int(self.user_ids[self.rows[username]])
+
+    def username(self, user_id):
+        """Return the username registered under a database id, or None"""
+        return self.by_id.get(user_id)
+
+    def get_vector(self, username):
+        """Return the user's vector (a view into the registry matrix)"""
+        return self.matrix[self.rows[username]]
+
+    def set_vector(self, username, vector):
+        row = self.rows[username]
+        self.matrix[row] = vector
+        self._stamp(row)
+
+    def version(self, username):
+        """Return a counter that increases whenever the user's vector is written"""
+        return int(self.versions[self.rows[username]])
+
+    def vectors(self):
+        """Return (usernames, matrix) of all registered users, one row per user"""
+        usernames = list(self.rows)
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(usernames))
+        return usernames, self.matrix[rows]
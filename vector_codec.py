@@ -0,0 +1,35 @@
+import struct
+
+import numpy as np
+
+# pgvector binary wire format: int16 dimension, int16 reserved, then
+# `dimension` big-endian float32 values.
+_HEADER = struct.Struct(">HH")
+_WIRE_DTYPE = np.dtype(">f4")
+
+
+def encode_vector(vector):
+    """Encode a NumPy array (or sequence of floats) as a binary pgvector"""
+    values = np.asarray(vector, dtype=_WIRE_DTYPE)
+    if values.ndim != 1:
+        raise ValueError(f"expected a 1-D vector, got shape {values.shape}")
+    return _HEADER.pack(values.shape[0], 0) + values.tobytes()
+
+
+def decode_vector(data):
+    """Decode a binary pgvector straight into a native float32 NumPy array"""
+    dim, _ = _HEADER.unpack_from(data)
+    return np.frombuffer(data, dtype=_WIRE_DTYPE, count=dim, offset=_HEADER.size).astype(
+        np.float32
+    )
+
+
+async def register_vector_codec(conn, schema="public"):
+    """Make `vector` columns round-trip as float32 arrays on this connection"""
+    await conn.set_type_codec(
+        "vector",
+        schema=schema,
+        encoder=encode_vector,
+        decoder=decode_vector,
+        format="binary",
+    )
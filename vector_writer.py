@@ -0,0 +1,190 @@
+import os
+import shutil
+
+import numpy as np
+
+
+class UserVectorWriter:
+    """Write-behind persistence of user vectors to user_prefs_api.
+
+    ``record`` marks a user dirty and appends (user id, vector) to a local
+    log; ``flush`` writes the current vector of every dirty user in one
+    bulk UPDATE, so a burst of likes costs a single row write per user.
+
+    The log is split into numbered segments. Each flush seals the active
+    segment first and deletes the sealed ones once its transaction commits,
+    so after a crash the surviving segments hold every vector that may not
+    have reached Postgres. Records are full vectors, so ``recover`` simply
+    writes the newest one per user and replaying twice is harmless.
+
+    Each process logs under its own ``<base_dir>/<pid>`` directory, so
+    several app workers can share ``base_dir``; ``recover`` (which must run
+    at startup, before ``record``) replays its own directory and claims
+    those of processes that are gone.
+    """
+
+    def __init__(self, registry, base_dir, fsync=False):
+        self.registry = registry
+        self.base_dir = base_dir
+        self.log_dir = None
+        self.fsync = fsync
+        self.dirty = set()
+        self.flushing = set()
+        self.flushes = 0
+        self.rows_written = 0
+        self._record = np.dtype([("user_id", "<i8"), ("vector", "<f4", (registry.dim,))])
+        self._seq = 0
+        self._log = None
+
+    def _segments(self, directory=None):
+        """(seq, path) of every log segment in ``directory``, oldest first"""
+        directory = self.log_dir if directory is None else directory
+        segments = []
+        for name in os.listdir(directory):
+            stem, ext = os.path.splitext(name)
+            if ext == ".log" and stem.isdigit():
+                segments.append((int(stem), os.path.join(directory, name)))
+        return sorted(segments)
+
+    def _claim_orphans(self, claim_dir):
+        """Move logs of processes no longer running into ``claim_dir``.
+
+        Workers sharing ``base_dir`` recover at the same time; a rename
+        succeeds for exactly one of them, so each orphan is replayed once.
+        """
+        for name in os.listdir(self.base_dir):
+            path = os.path.join(self.base_dir, name)
+            stem, ext = os.path.splitext(name)
+            if ext == ".log" and stem.isdigit():
+                # Segments from before logs were split per process
+                target = os.path.join(claim_dir, "base", name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+            elif name.isdigit() and int(name) != os.getpid():
+                try:
+                    os.kill(int(name), 0)
+                    continue
+                except ProcessLookupError:
+                    target = os.path.join(claim_dir, name)
+                except PermissionError:
+                    continue
+            else:
+                continue
+            try:
+                os.rename(path, target)
+            except OSError:
+                # Another worker claimed it first
+                continue
+
+    def _open_segment(self):
+        self._log = open(os.path.join(self.log_dir, f"{self._seq:012d}.log"), "ab")
+
+    def _seal(self):
+        """Close the active segment; later records go to a new one"""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+            self._seq += 1
+        return self._seq
+
+    def record(self, username):
+        """Log the user's current vector and schedule it for the next flush"""
+        entry = np.zeros(1, dtype=self._record)
+        entry["user_id"] = self.registry.user_id(username)
+        entry["vector"] = self.registry.get_vector(username)
+        if self._log is None:
+            self._open_segment()
+        self._log.write(entry.tobytes())
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self.dirty.add(username)
+
+    def unflushed(self):
+        """Users whose current vector may not be in Postgres yet"""
+        return self.dirty | self.flushing
+
+    async def _write(self, conn, user_ids, vectors):
+        """Bulk-update user vectors through a COPY into a staging table"""
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE user_vector_staging (
+                    id INTEGER PRIMARY KEY,
+                    user_vector vector(4096)
+                ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                "user_vector_staging",
+                records=zip(user_ids, vectors),
+                columns=["id", "user_vector"],
+            )
+            await conn.execute("""
+                UPDATE user_prefs_api u
+                SET user_vector = s.user_vector
+                FROM user_vector_staging s
+                WHERE u.id = s.id
+            """)
+
+    async def flush(self, conn):
+        """Write every dirty user's current vector; return how many were written"""
+        if not self.dirty:
+            return 0
+        usernames = list(self.dirty)
+        self.flushing.update(usernames)
+        self.dirty.clear()
+        sealed_before = self._seal()
+        user_ids = [self.registry.user_id(username) for username in usernames]
+        vectors = [self.registry.get_vector(username).copy() for username in usernames]
+        try:
+            await self._write(conn, user_ids, vectors)
+        except BaseException:
+            # Keep the sealed segments and retry these users next time
+            self.dirty.update(usernames)
+            raise
+        finally:
+            self.flushing.difference_update(usernames)
+
+        for seq, path in self._segments():
+            if seq < sealed_before:
+                os.remove(path)
+        self.flushes += 1
+        self.rows_written += len(user_ids)
+        return len(user_ids)
+
+    async def recover(self, conn):
+        """Write vectors logged by crashed processes; run before loading users"""
+        # Our own directory may hold logs of a crashed process with this pid
+        self.log_dir = os.path.join(self.base_dir, str(os.getpid()))
+        claim_dir = os.path.join(self.log_dir, "claimed")
+        os.makedirs(claim_dir, exist_ok=True)
+        self._claim_orphans(claim_dir)
+        # Including orphans a crashed process had claimed but not replayed
+        claimed = [directory for directory, _, _ in os.walk(claim_dir)]
+
+        # Across directories, the most recently written segment wins
+        # (renames keep modification times)
+        segments = sorted(
+            (os.path.getmtime(path), seq, path)
+            for directory in [self.log_dir, *claimed]
+            for seq, path in self._segments(directory)
+        )
+        latest = {}
+        for _, _, path in segments:
+            with open(path, "rb") as f:
+                data = f.read()
+            # A torn final record from a crash mid-write is dropped
+            usable = len(data) - len(data) % self._record.itemsize
+            for entry in np.frombuffer(data[:usable], dtype=self._record):
+                latest[int(entry["user_id"])] = entry["vector"]
+
+        if latest:
+            await self._write(conn, list(latest), list(latest.values()))
+            print(f"Recovered {len(latest)} unflushed user vectors from {self.base_dir}")
+        for _, _, path in segments:
+            os.remove(path)
+        for name in os.listdir(claim_dir):
+            shutil.rmtree(os.path.join(claim_dir, name))
+        self._seq = 0
+        return len(latest)
+
+    def close(self):
+        self._seal()
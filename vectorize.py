@@ -1,28 +1,439 @@
 import asyncio
 import asyncpg
+import json
+import multiprocessing
 import os
+import queue
+import time
+import torch
+import numpy as np
 from dotenv import load_dotenv
+from embedding_cache import EmbeddingCache, normalize_text
+from migrate_data import migrate_posts
+from schema import TARGET_TABLE, find_text_columns, get_table_spec
 from sentence_transformers import SentenceTransformer
+from vector_codec import register_vector_codec
+
+load_dotenv()
+
+MODEL_NAME = "Qwen/Qwen3-Embedding-8B"
+CHECKPOINT_PATH = os.getenv("EMBED_CHECKPOINT", ".vectorize_checkpoint.json")
+SHARD_PLAN_PATH = f"{CHECKPOINT_PATH}.shards"
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE", ".embedding_cache.sqlite")
+MAX_ID = 2**63 - 1
+
+
+def pick_device():
+    """Use EMBED_DEVICE if set, else the best available accelerator, else CPU"""
+    device = os.getenv("EMBED_DEVICE")
+    if device:
+        return device
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def load_qwen_model(device=None):
+    device = device or pick_device()
+    if device == "cuda":
+        print("Loading Qwen3-Embedding-8B model in 8-bit...")
+        model_kwargs = {"load_in_8bit": True, "device_map": "auto"}
+        return SentenceTransformer(MODEL_NAME, model_kwargs=model_kwargs)
+
+    # bitsandbytes 8-bit loading needs CUDA; fall back to bfloat16 weights
+    print(f"No CUDA device, loading Qwen3-Embedding-8B in bfloat16 on {device}...")
+    return SentenceTransformer(
+        MODEL_NAME, device=device, model_kwargs={"torch_dtype": torch.bfloat16}
+    )
 
 
-def load_qwen_model():
-    print("Loading Qwen3-Embedding-8B model in 8-bit...")
-    model = SentenceTransformer(
-        "Qwen/Qwen3-Embedding-8B",
-        model_kwargs={"load_in_8bit": True, "device_map": "auto"},
-    )
-    return model
+def combine_text(title, description):
+    return normalize_text(f"{title or ''} {description or ''}")
 
 
-def generate_embedding(model, title, description):
-    combined_text = f"{title or ''} {description or ''}".strip()
-    if not combined_text:
+def open_embedding_cache():
+    """Open the content-hash embedding cache, unless EMBED_CACHE is empty"""
+    if not EMBED_CACHE_PATH:
         return None
+    return EmbeddingCache(EMBED_CACHE_PATH, MODEL_NAME)
+
+
+def generate_embeddings(model, texts, batch_size=32):
+    """Encode a list of texts in batches, returning a float32 array per text.
+
+    SentenceTransformer.encode sorts the texts by length before batching, so
+    passing a whole page at once gives length-bucketed batches with minimal
+    padding; results come back in input order.
+    """
+    embeddings = model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return embeddings.astype("float32", copy=False)
+
+
+def embed_texts(model, texts, batch_size=32, cache=None):
+    """Embed texts, running the model only on those not already cached.
+
+    Duplicate texts within the call are encoded once.
+    """
+    if cache is None:
+        return generate_embeddings(model, texts, batch_size)
+
+    keys = [cache.key(text) for text in texts]
+    vectors = cache.get_many(set(keys))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in vectors:
+            missing.setdefault(key, text)
+    if missing:
+        encoded = generate_embeddings(model, list(missing.values()), batch_size)
+        fresh = dict(zip(missing, encoded))
+        cache.put_many(fresh.items())
+        vectors.update(fresh)
+
+    return np.stack([vectors[key] for key in keys])
+
+
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """Return the last fully written id and row count of an interrupted run"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"last_id": -1, "processed": 0}
+
+
+def save_checkpoint(checkpoint, path=CHECKPOINT_PATH):
+    # Write-then-rename so a crash never leaves a truncated checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+class ProgressReport:
+    """Throughput and ETA for a run with ``total`` rows left to process"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.start = time.monotonic()
+
+    def update(self, rows):
+        self.done += rows
+
+    def report(self):
+        print(f"Progress: {self}")
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else float("inf")
+        percent = self.done / self.total * 100 if self.total else 100.0
+        return (
+            f"{self.done}/{self.total} posts processed ({percent:.1f}%), "
+            f"{rate:.1f} rows/s, ETA {eta / 60:.1f} min"
+        )
+
+
+async def create_staging_table(conn):
+    """Session-local table that batches of (id, vector) pairs are copied into"""
+    await conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS qwen_vector_staging (
+            id BIGINT PRIMARY KEY,
+            qwen_vector vector(4096) NOT NULL
+        ) ON COMMIT DELETE ROWS
+    """)
+
+
+async def write_embeddings(conn, ids, embeddings):
+    """Write a batch of embeddings with one binary COPY and one UPDATE"""
+    async with conn.transaction():
+        await conn.copy_records_to_table(
+            "qwen_vector_staging",
+            records=zip(ids, embeddings),
+            columns=["id", "qwen_vector"],
+        )
+        await conn.execute("""
+            UPDATE social_search_prefs p
+            SET qwen_vector = s.qwen_vector
+            FROM qwen_vector_staging s
+            WHERE p.id = s.id
+        """)
+
+
+def page_texts(batch, title_col, desc_col):
+    """Split a fetched page into ids and texts, skipping rows with no text"""
+    ids = []
+    texts = []
+    for row in batch:
+        title = row.get(title_col) if title_col else ""
+        description = row.get(desc_col) if desc_col else ""
+        combined_text = combine_text(title, description)
+        if combined_text:
+            ids.append(row["id"])
+            texts.append(combined_text)
+    return ids, texts
+
+
+async def read_pages(pool, query, last_id, end_id, fetch_queue):
+    """Producer: prefetch pages of unembedded posts by keyset"""
+    async with pool.acquire() as conn:
+        while True:
+            batch = await conn.fetch(query, last_id, end_id)
+            if not batch:
+                break
+            last_id = batch[-1]["id"]
+            await fetch_queue.put(batch)
+    await fetch_queue.put(None)
+
+
+async def encode_pages(
+    model, fetch_queue, write_queue, title_col, desc_col, batch_size, cache=None
+):
+    """Run the model in a worker thread so fetches and writes keep flowing"""
+    while (batch := await fetch_queue.get()) is not None:
+        ids, texts = page_texts(batch, title_col, desc_col)
+        embeddings = []
+        if texts:
+            embeddings = await asyncio.to_thread(
+                embed_texts, model, texts, batch_size, cache
+            )
+        await write_queue.put((batch[-1]["id"], len(batch), ids, embeddings))
+    await write_queue.put(None)
+
+
+async def write_pages(pool, write_queue, checkpoint, checkpoint_path, progress):
+    """Consumer: flush encoded pages and advance the checkpoint in order"""
+    async with pool.acquire() as conn:
+        await create_staging_table(conn)
+        while (item := await write_queue.get()) is not None:
+            last_id, rows, ids, embeddings = item
+            if ids:
+                await write_embeddings(conn, ids, embeddings)
+
+            checkpoint["last_id"] = last_id
+            checkpoint["processed"] += rows
+            save_checkpoint(checkpoint, checkpoint_path)
+
+            progress.update(rows)
+            progress.report()
+
+
+async def run_pipeline(
+    pool,
+    model,
+    query,
+    title_col,
+    desc_col,
+    checkpoint,
+    progress,
+    encode_batch_size,
+    queue_depth=2,
+    end_id=MAX_ID,
+    checkpoint_path=CHECKPOINT_PATH,
+    cache=None,
+):
+    """Run reader, encoder and writer concurrently until the reader runs dry.
+
+    Bounded queues cap how far the reader can run ahead of the model and how
+    many encoded pages can wait on the writer. If any stage fails, the task
+    group cancels the others; the checkpoint only ever covers written pages.
+    """
+    fetch_queue = asyncio.Queue(maxsize=queue_depth)
+    write_queue = asyncio.Queue(maxsize=queue_depth)
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(
+            read_pages(pool, query, checkpoint["last_id"], end_id, fetch_queue)
+        )
+        tg.create_task(
+            encode_pages(
+                model,
+                fetch_queue,
+                write_queue,
+                title_col,
+                desc_col,
+                encode_batch_size,
+                cache,
+            )
+        )
+        tg.create_task(
+            write_pages(pool, write_queue, checkpoint, checkpoint_path, progress)
+        )
 
-    embedding = model.encode(combined_text, convert_to_numpy=True)
-    # Convert to PostgreSQL vector format
-    vector_str = "[" + ",".join(map(str, embedding.tolist())) + "]"
-    return vector_str
+
+class ShardProgress:
+    """Forwards a shard's written row counts to the coordinator process"""
+
+    def __init__(self, shard, queue):
+        self.shard = shard
+        self.queue = queue
+
+    def update(self, rows):
+        self.queue.put((self.shard, rows))
+
+    def report(self):
+        pass
+
+
+def shard_checkpoint_path(shard):
+    return f"{CHECKPOINT_PATH}.shard{shard}"
+
+
+async def plan_shards(conn, shards):
+    """Split unembedded ids into contiguous ranges with equal row counts.
+
+    The plan is persisted so a restarted run keeps the same ranges and each
+    shard can resume from its own checkpoint. Each range is
+    ``[start_after, end_id]``.
+    """
+    if os.path.exists(SHARD_PLAN_PATH):
+        with open(SHARD_PLAN_PATH) as f:
+            plan = json.load(f)
+        print(f"Resuming existing {len(plan)}-shard plan from {SHARD_PLAN_PATH}")
+        return plan
+
+    rows = await conn.fetch(
+        """
+        SELECT min(id) AS first_id, max(id) AS last_id
+        FROM (
+            SELECT id, ntile($1) OVER (ORDER BY id) AS shard
+            FROM social_search_prefs
+            WHERE qwen_vector IS NULL
+        ) s
+        GROUP BY shard
+        ORDER BY shard
+    """,
+        shards,
+    )
+    plan = [[row["first_id"] - 1, row["last_id"]] for row in rows]
+    save_checkpoint(plan, SHARD_PLAN_PATH)
+    return plan
+
+
+async def count_shard_rows(conn, plan):
+    """Unembedded rows each shard of ``plan`` still has ahead of its checkpoint"""
+    total = 0
+    for shard, (start_after, end_id) in enumerate(plan):
+        resume_after = max(start_after, load_checkpoint(shard_checkpoint_path(shard))["last_id"])
+        total += await conn.fetchval(
+            """
+            SELECT COUNT(*) FROM social_search_prefs
+            WHERE qwen_vector IS NULL AND id > $1 AND id <= $2
+        """,
+            resume_after,
+            end_id,
+        )
+    return total
+
+
+def remove_shard_plan(shards):
+    """Delete the shard plan and its checkpoints, so the next run plans afresh"""
+    os.remove(SHARD_PLAN_PATH)
+    for shard in range(shards):
+        if os.path.exists(shard_checkpoint_path(shard)):
+            os.remove(shard_checkpoint_path(shard))
+
+
+async def run_shard(
+    db_config,
+    shard,
+    start_after,
+    end_id,
+    query,
+    title_col,
+    desc_col,
+    progress_queue,
+    threads,
+):
+    torch.set_num_threads(threads)
+    checkpoint_path = shard_checkpoint_path(shard)
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint["last_id"] = max(checkpoint["last_id"], start_after)
+
+    model = load_qwen_model()
+    cache = open_embedding_cache()
+    pool = await asyncpg.create_pool(
+        **db_config, min_size=2, max_size=2, init=register_vector_codec
+    )
+    try:
+        await run_pipeline(
+            pool,
+            model,
+            query,
+            title_col,
+            desc_col,
+            checkpoint,
+            ShardProgress(shard, progress_queue),
+            int(os.getenv("EMBED_BATCH_SIZE", 32)),
+            queue_depth=int(os.getenv("EMBED_QUEUE_DEPTH", 2)),
+            end_id=end_id,
+            checkpoint_path=checkpoint_path,
+            cache=cache,
+        )
+    finally:
+        await pool.close()
+        if cache is not None:
+            print(f"Shard {shard} embedding cache: {cache.hits} hits, {cache.misses} misses")
+            cache.close()
+
+
+def shard_worker(*args):
+    """Process entry point: embed one id range with a private model copy"""
+    asyncio.run(run_shard(*args))
+
+
+def run_sharded(db_config, plan, query, title_col, desc_col, total):
+    """Run one worker process per shard and aggregate their progress"""
+    # spawn, not fork: each worker builds its own torch/CUDA state
+    ctx = multiprocessing.get_context("spawn")
+    progress_queue = ctx.Queue()
+    threads = max(1, (os.cpu_count() or 1) // len(plan))
+
+    workers = [
+        ctx.Process(
+            target=shard_worker,
+            args=(
+                db_config,
+                shard,
+                start_after,
+                end_id,
+                query,
+                title_col,
+                desc_col,
+                progress_queue,
+                threads,
+            ),
+        )
+        for shard, (start_after, end_id) in enumerate(plan)
+    ]
+    for worker in workers:
+        worker.start()
+
+    progress = ProgressReport(total)
+    shard_done = [0] * len(plan)
+    while any(worker.is_alive() for worker in workers) or not progress_queue.empty():
+        try:
+            shard, rows = progress_queue.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        shard_done[shard] += rows
+        progress.update(rows)
+        print(f"Progress: {progress} (per shard: {shard_done})")
+
+    for worker in workers:
+        worker.join()
+    failed = [shard for shard, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Shards {failed} failed; rerun to resume them")
+
+    remove_shard_plan(len(plan))
 
 
 async def main():
@@ -40,241 +451,52 @@ async def main():
     conn = await asyncpg.connect(**db_config)
 
     try:
-        # First, get the structure of social_search_2 table
-        print("Getting structure of social_search_2 table...")
-        table_info = await conn.fetch("""
-            SELECT column_name, data_type, character_maximum_length, is_nullable, column_default
-            FROM information_schema.columns
-            WHERE table_name = 'social_search_2'
-            ORDER BY ordinal_position;
-        """)
-
-        if not table_info:
-            print("Error: social_search_2 table not found!")
+        # Create and fill social_search_prefs first if that hasn't happened yet
+        if not await migrate_posts(conn, db_config):
             return
 
-        # Check if social_search_prefs already exists
-        existing_table = await conn.fetchval("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables
-                WHERE table_name = 'social_search_prefs'
-            );
-        """)
-
-        if not existing_table:
-            print("Creating social_search_prefs table...")
-            print("Table structure from social_search_2:")
-            for col in table_info:
-                print(f"  {col['column_name']}: {col['data_type']}")
-
-            # Build CREATE TABLE statement based on social_search_2 structure
-            columns = []
-            excluded_columns = [
-                "canonical_url",
-                "vsearch",
-                "minilm_vectors",
-                "blip_vector",
-            ]
-
-            for col in table_info:
-                col_name = col["column_name"]
-
-                # Skip excluded columns
-                if col_name in excluded_columns:
-                    continue
-
-                data_type = col["data_type"]
-                max_length = col["character_maximum_length"]
-                is_nullable = col["is_nullable"]
-                default_val = col["column_default"]
-
-                # Handle reserved keywords by quoting them
-                if col_name.upper() in [
-                    "USER",
-                    "ORDER",
-                    "GROUP",
-                    "SELECT",
-                    "FROM",
-                    "WHERE",
-                ]:
-                    col_name = f'"{col_name}"'
-
-                # Handle different data types
-                if data_type == "character varying" and max_length:
-                    col_def = f"{col_name} VARCHAR({max_length})"
-                elif data_type == "text":
-                    col_def = f"{col_name} TEXT"
-                elif data_type == "integer":
-                    col_def = f"{col_name} INTEGER"
-                elif data_type == "bigint":
-                    col_def = f"{col_name} BIGINT"
-                elif data_type == "timestamp without time zone":
-                    col_def = f"{col_name} TIMESTAMP"
-                elif data_type == "timestamp with time zone":
-                    col_def = f"{col_name} TIMESTAMPTZ"
-                elif data_type == "boolean":
-                    col_def = f"{col_name} BOOLEAN"
-                elif data_type == "numeric":
-                    col_def = f"{col_name} NUMERIC"
-                elif data_type == "real":
-                    col_def = f"{col_name} REAL"
-                elif data_type == "double precision":
-                    col_def = f"{col_name} DOUBLE PRECISION"
-                elif data_type == "jsonb":
-                    col_def = f"{col_name} JSONB"
-                elif data_type == "json":
-                    col_def = f"{col_name} JSON"
-                elif data_type == "ARRAY":
-                    col_def = f"{col_name} TEXT[]"
-                else:
-                    col_def = f"{col_name} TEXT"
-
-                if is_nullable == "NO":
-                    col_def += " NOT NULL"
-
-                if default_val and "nextval" not in default_val:
-                    col_def += f" DEFAULT {default_val}"
-
-                columns.append(col_def)
-
-            # Add the new qwen_vector column
-            columns.append("qwen_vector vector(4096)")
-
-            create_table_sql = f"""
-                CREATE TABLE social_search_prefs (
-                    {", ".join(columns)}
-                );
-            """
-
-            print(f"CREATE TABLE SQL: {create_table_sql}")
-            await conn.execute(create_table_sql)
-            print("social_search_prefs table created successfully!")
-        else:
-            print("social_search_prefs table already exists.")
-            # Check if qwen_vector column exists and has correct type
-            qwen_col = await conn.fetchval("""
-                SELECT data_type FROM information_schema.columns
-                WHERE table_name = 'social_search_prefs' AND column_name = 'qwen_vector'
-            """)
-
-            if qwen_col != "USER-DEFINED":
-                print("Updating qwen_vector column to vector(4096) type...")
-                if qwen_col:
-                    # Column exists but wrong type, drop and recreate
-                    await conn.execute(
-                        "ALTER TABLE social_search_prefs DROP COLUMN qwen_vector"
-                    )
-                # Add the vector column
-                await conn.execute(
-                    "ALTER TABLE social_search_prefs ADD COLUMN qwen_vector vector(4096)"
-                )
-                print("qwen_vector column updated successfully!")
-
-        # Check current count in social_search_prefs
-        current_count = await conn.fetchval("SELECT COUNT(*) FROM social_search_prefs")
-        print(f"Current records in social_search_prefs: {current_count}")
-
-        # Check if we need to copy data
-        if current_count == 0:
-            print("Copying last 700k posts from social_search_2...")
-
-            # First, let's check what columns exist and find the time column
-            time_column = None
-            for col in table_info:
-                col_name = col["column_name"].lower()
-                if "time" in col_name or "date" in col_name or "created" in col_name:
-                    time_column = col["column_name"]
-                    break
-
-            if not time_column:
+        # Generate embeddings for posts that don't have them yet, resuming
+        # after the last id an interrupted run fully wrote
+        checkpoint = load_checkpoint()
+        print("Checking for posts without embeddings...")
+        unembedded_count = await conn.fetchval(
+            "SELECT COUNT(*) FROM social_search_prefs WHERE qwen_vector IS NULL"
+        )
+        if unembedded_count > 0 and checkpoint["last_id"] >= 0:
+            remaining = await conn.fetchval(
+                """
+                SELECT COUNT(*) FROM social_search_prefs
+                WHERE qwen_vector IS NULL AND id > $1
+            """,
+                checkpoint["last_id"],
+            )
+            if remaining:
+                # Rows below the checkpoint are picked up by the next run
                 print(
-                    "Warning: Could not identify time column. Using first column for ordering."
+                    f"Resuming from checkpoint: id > {checkpoint['last_id']} "
+                    f"({checkpoint['processed']} posts already processed)"
                 )
-                time_column = table_info[0]["column_name"]
-
-            print(f"Using column '{time_column}' for time-based ordering")
-
-            # Copy data with LIMIT 700000 ordered by time DESC
-            excluded_columns = [
-                "canonical_url",
-                "vsearch",
-                "minilm_vectors",
-                "blip_vector",
-            ]
-            column_names = []
-            for col in table_info:
-                col_name = col["column_name"]
-                # Skip excluded columns
-                if col_name in excluded_columns:
-                    continue
-                if col_name.upper() in [
-                    "USER",
-                    "ORDER",
-                    "GROUP",
-                    "SELECT",
-                    "FROM",
-                    "WHERE",
-                ]:
-                    col_name = f'"{col_name}"'
-                column_names.append(col_name)
-            columns_str = ", ".join(column_names)
-
-            copy_sql = f"""
-                INSERT INTO social_search_prefs ({columns_str})
-                SELECT {columns_str}
-                FROM social_search_2
-                ORDER BY {time_column} DESC
-                LIMIT 700000;
-            """
-
-            print("Executing data copy... This may take a while.")
-            await conn.execute(copy_sql)
-
-            # Verify the copy
-            final_count = await conn.fetchval(
-                "SELECT COUNT(*) FROM social_search_prefs"
-            )
-            print(f"Data copy completed! Records copied: {final_count}")
-        else:
-            print(f"Table already has {current_count} records. Skipping data copy.")
-
-        # Generate embeddings for posts that don't have them yet
-        print("Checking for posts without embeddings...")
-        unembedded_count = await conn.fetchval("""
-            SELECT COUNT(*) FROM social_search_prefs
-            WHERE qwen_vector IS NULL
-        """)
+                unembedded_count = remaining
+            else:
+                # Rows left unembedded lie below the checkpoint, where
+                # resuming would never reach them
+                print(f"Nothing left after checkpoint id {checkpoint['last_id']}; starting over")
+                os.remove(CHECKPOINT_PATH)
+                checkpoint = load_checkpoint()
 
         if unembedded_count > 0:
             print(
                 f"Found {unembedded_count} posts without embeddings. Generating vectors..."
             )
 
-            # Load the model
-            model = load_qwen_model()
-
-            # Process in batches to avoid memory issues
-            batch_size = 100
-            processed = 0
+            # Rows fetched per page, and texts per forward pass of the model
+            batch_size = int(os.getenv("EMBED_FETCH_SIZE", 512))
+            encode_batch_size = int(os.getenv("EMBED_BATCH_SIZE", 32))
+            progress = ProgressReport(unembedded_count)
 
             # Get posts that need embeddings, assuming common column names
             # We'll check what columns are actually available
-            column_check = await conn.fetch("""
-                SELECT column_name FROM information_schema.columns
-                WHERE table_name = 'social_search_prefs'
-                AND column_name IN ('title', 'description', 'content', 'text', 'body')
-                ORDER BY
-                    CASE column_name
-                        WHEN 'title' THEN 1
-                        WHEN 'description' THEN 2
-                        WHEN 'content' THEN 3
-                        WHEN 'text' THEN 4
-                        WHEN 'body' THEN 5
-                        ELSE 6
-                    END
-            """)
-
-            available_columns = [row["column_name"] for row in column_check]
+            available_columns = await find_text_columns(conn)
             print(f"Available text columns: {available_columns}")
 
             if not available_columns:
@@ -282,11 +504,7 @@ async def main():
                     "Warning: No title, description, content, text, or body columns found!"
                 )
                 # Let's see all available columns
-                all_columns = await conn.fetch("""
-                    SELECT column_name FROM information_schema.columns
-                    WHERE table_name = 'social_search_prefs'
-                    ORDER BY ordinal_position
-                """)
+                all_columns = await get_table_spec(conn, TARGET_TABLE)
                 print("All available columns:")
                 for col in all_columns:
                     print(f"  - {col['column_name']}")
@@ -305,48 +523,65 @@ async def main():
             if desc_col:
                 select_cols.append(desc_col)
 
-            while processed < unembedded_count:
-                # Get a batch of unembedded posts
-                query = f"""
-                    SELECT {", ".join(select_cols)}
-                    FROM social_search_prefs
-                    WHERE qwen_vector IS NULL
-                    ORDER BY id
-                    LIMIT {batch_size} OFFSET {processed}
-                """
-
-                batch = await conn.fetch(query)
-                if not batch:
-                    break
+            # Keyset pagination: rows with no text stay NULL, so page by id
+            # rather than OFFSET into the shrinking IS NULL set
+            query = f"""
+                SELECT {", ".join(select_cols)}
+                FROM social_search_prefs
+                WHERE qwen_vector IS NULL AND id > $1 AND id <= $2
+                ORDER BY id
+                LIMIT {batch_size}
+            """
 
-                print(
-                    f"Processing batch {processed // batch_size + 1} ({len(batch)} posts)..."
+            shards = int(os.getenv("EMBED_SHARDS", 1))
+            if shards > 1:
+                # One process and model copy per contiguous id range
+                plan = await plan_shards(conn, shards)
+                total = await count_shard_rows(conn, plan)
+                if total == 0:
+                    # A stale plan's ranges are done but rows outside or
+                    # below its checkpoints are not
+                    print("Nothing left in the saved shard plan; planning again")
+                    remove_shard_plan(len(plan))
+                    plan = await plan_shards(conn, shards)
+                    total = await count_shard_rows(conn, plan)
+                print(f"Embedding {total} posts across {len(plan)} worker processes...")
+                await asyncio.to_thread(
+                    run_sharded, db_config, plan, query, title_col, desc_col, total
                 )
+                print("Embedding generation completed!")
+                return
 
-                # Generate embeddings for this batch
-                for row in batch:
-                    title = row.get(title_col) if title_col else ""
-                    description = row.get(desc_col) if desc_col else ""
-
-                    embedding = generate_embedding(model, title, description)
-
-                    if embedding:
-                        # Update the post with its embedding
-                        await conn.execute(
-                            """
-                            UPDATE social_search_prefs
-                            SET qwen_vector = $1::vector
-                            WHERE id = $2
-                        """,
-                            embedding,
-                            row["id"],
-                        )
-
-                processed += len(batch)
-                print(
-                    f"Progress: {processed}/{unembedded_count} posts processed ({processed / unembedded_count * 100:.1f}%)"
-                )
+            # Load the model
+            model = load_qwen_model()
+            cache = open_embedding_cache()
 
+            # Overlap fetch, encode and write-back through bounded queues
+            pool = await asyncpg.create_pool(
+                **db_config, min_size=2, max_size=2, init=register_vector_codec
+            )
+            try:
+                await run_pipeline(
+                    pool,
+                    model,
+                    query,
+                    title_col,
+                    desc_col,
+                    checkpoint,
+                    progress,
+                    encode_batch_size,
+                    queue_depth=int(os.getenv("EMBED_QUEUE_DEPTH", 2)),
+                    cache=cache,
+                )
+            finally:
+                await pool.close()
+                if cache is not None:
+                    print(f"Embedding cache: {cache.hits} hits, {cache.misses} misses")
+                    cache.close()
+
+            # A finished run starts from scratch next time
+            if os.path.exists(CHECKPOINT_PATH):
+                os.remove(CHECKPOINT_PATH)
             print("Embedding generation completed!")
         else:
             print("All posts already have embeddings.")